@@ -1,10 +1,35 @@
 import os
+import io
 import time
+_INICIO_IMPORT = time.perf_counter()
 import re
+import json
+import base64
+import bisect
+import fcntl
+import glob
+import hashlib
+import hmac
+import mimetypes
+import multiprocessing
+import secrets
+import tempfile
+import shutil
+import sqlite3
+import threading
 import unicodedata
-from flask import Flask, request, jsonify, render_template_string
-from supabase import create_client, Client
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import cache, lru_cache, wraps
+from urllib.parse import urlencode, urljoin
+import httpx
+from flask import Flask, Request, Response, abort, g, has_request_context, request, jsonify, send_file, stream_with_context, url_for
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
 from dotenv import load_dotenv
+# supabase/postgrest/storage3 e Pillow são importados só no primeiro uso (ver ClienteSupabase e formatos_suportados)
 
 # Carrega variáveis de ambiente (.env)
 load_dotenv()
@@ -17,7 +42,408 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 APP_PASSWORD = os.getenv("APP_PASSWORD")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Sessões: tokens assinados (HMAC) emitidos pelo /api/login, com escopo admin (painel) ou read (bots)
+# Sem SESSION_SECRET, a chave é derivada da senha + chave do Supabase (trocar a senha derruba as sessões)
+SESSION_SECRET = os.getenv("SESSION_SECRET") or hmac.new(
+    (SUPABASE_KEY or "").encode(), f"sessao:{APP_PASSWORD}".encode(), hashlib.sha256
+).hexdigest()
+SESSION_TTL = int(os.getenv("SESSION_TTL", str(8 * 3600)))
+READ_TOKEN_TTL_MAX = int(os.getenv("READ_TOKEN_TTL_MAX", str(365 * 24 * 3600)))
+ESCOPOS = ("admin", "read")
+
+# Conexões HTTP: um pool por processo, com keep-alive e HTTP/2
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+HTTP_MAX_CONEXOES = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP2 = os.getenv("HTTP2", "1") == "1"
+
+# Subida: orçamento de tempo do import + create_app (medido pelo bench/startup.py)
+STARTUP_BUDGET_MS = int(os.getenv("STARTUP_BUDGET_MS", "500"))
+
+_clientes = {}
+_clientes_lock = threading.Lock()
+
+# Paginação das listagens (keyset em created_at)
+LIMITE_PADRAO = int(os.getenv("PAGE_SIZE", "30"))
+LIMITE_MAXIMO = int(os.getenv("PAGE_SIZE_MAX", "100"))
+
+COLUNAS_GALERIA = "nome_arquivo,url_imagem,tags,variantes,created_at"
+COLUNAS_PROMOCOES = "nome_arquivo,url_imagem,titulo,texto_informativo,tag,variantes,created_at"
+
+# Cache das listagens: TTL local + geração compartilhada entre os workers do gunicorn
+CACHE_TTL = float(os.getenv("LIST_CACHE_TTL", "60"))
+CACHE_MAX_ENTRADAS = int(os.getenv("LIST_CACHE_MAX", "256"))
+ARQUIVO_GERACAO = os.getenv(
+    "CACHE_GENERATION_FILE", os.path.join(tempfile.gettempdir(), "galeria_privada_geracao")
+)
+
+_cache_listagens = {}
+_cache_lock = threading.Lock()
+
+# Feed de alterações: long-poll (?wait=) e SSE esperam pela mesma geração do cache
+CHANGES_WAIT_MAX = float(os.getenv("CHANGES_WAIT_MAX", "30"))
+CHANGES_POLL = float(os.getenv("CHANGES_POLL_SECONDS", "5"))  # consulta o banco mesmo sem escrita local
+CHANGES_HEARTBEAT = float(os.getenv("CHANGES_HEARTBEAT", "15"))
+CHANGES_INTERVALO = 0.1
+# Só entram no feed escritas mais velhas que a janela: carimbos e ids são dados antes do commit,
+# então uma transação que termina depois pode trazer linhas "do passado" (deve ser maior que a mais longa)
+CHANGES_SETTLE = float(os.getenv("CHANGES_SETTLE_SECONDS", "2"))
+CHANGES_RETENCAO = int(os.getenv("CHANGES_RETENTION_DAYS", "30")) * 24 * 3600  # lápides; tokens mais velhos pedem recarga
+
+# Uploads: limite de tamanho e envio em partes para o Storage
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "25"))
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB * 1024 * 1024
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR", tempfile.gettempdir())
+LIMITE_RESUMABLE = int(os.getenv("RESUMABLE_THRESHOLD_MB", "6")) * 1024 * 1024
+TAMANHO_PARTE_TUS = 6 * 1024 * 1024  # o endpoint resumable do Supabase exige partes de 6 MB
+TAMANHO_BLOCO = 256 * 1024
+TENTATIVAS_UPLOAD = int(os.getenv("UPLOAD_RETRIES", "3"))
+BLOB_GC_DELAY = int(os.getenv("BLOB_GC_DELAY", "600"))  # segundos antes de apagar um blob sem referências
+TABELAS_COM_IMAGEM = ("galeria_tags_jundiai", "promocoes_ativas_jundiai")
+MAX_BATCH_MB = int(os.getenv("MAX_BATCH_MB", "500"))
+BATCH_MAX_ARQUIVOS = int(os.getenv("BATCH_MAX_FILES", "200"))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+
+# Upload retomável: o navegador manda partes pequenas (em paralelo) e o app só monta o arquivo no fim.
+# Sessão e partes ficam no bucket (<prefixo>/<id>/), não no disco do dyno: com vários dynos (ou um
+# restart no meio do envio) cada PUT pode cair num processo diferente.
+UPLOAD_PREFIXO = os.getenv("UPLOAD_SESSIONS_PREFIX", "uploads")
+TAMANHO_PARTE_UPLOAD = int(os.getenv("UPLOAD_PART_KB", "1024")) * 1024
+UPLOAD_SESSAO_TTL = int(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+
+# Operações em lote: teto de nomes por pedido, nomes por filtro in.() (vai na URL) e objetos por storage.remove
+BULK_MAX = int(os.getenv("BULK_MAX_NAMES", "1000"))
+BULK_IN_LOTE = 200
+STORAGE_REMOVE_LOTE = 1000
+
+# Variantes geradas no upload (lado máximo em pixels) e qualidade por formato
+VARIANTES = {"thumb": 320, "medium": 960, "full": 2048}
+QUALIDADE = {"avif": 55, "webp": 80, "jpeg": 82}
+FORMATOS_PIL = {"avif": "AVIF", "webp": "WEBP", "jpeg": "JPEG"}
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+# Proxy de imagens (/img/<nome>): versões sob demanda num cache em disco com LRU, feito para ficar atrás de uma CDN
+IMG_CACHE_DIR = os.getenv("IMG_CACHE_DIR", os.path.join(tempfile.gettempdir(), "galeria_privada_img"))
+IMG_CACHE_MB = int(os.getenv("IMG_CACHE_MB", "1024"))
+IMG_LARGURAS = (160, 320, 480, 640, 960, 1280, 1600, 2048)
+IMG_QUALIDADES = (40, 60, 80, 90)  # ?q= vai para o degrau mais próximo (sem q, vale QUALIDADE do formato)
+IMG_MAX_AGE = 365 * 24 * 3600
+IMG_SIGNING_KEY = os.getenv("IMG_SIGNING_KEY", "")  # com chave, /img só aceita URLs assinadas (bucket privado)
+IMG_PROXY = os.getenv("IMG_PROXY", "0") == "1"  # listagens apontam para /img em vez do storage
+IMG_BASE_URL = os.getenv("IMG_BASE_URL", "").rstrip("/")  # ex.: domínio da CDN; vazio usa o host do request
+
+_img_cache = {"total": None}
+_img_cache_lock = threading.Lock()
+
+# Fila local de tarefas (SQLite) para os efeitos colaterais no storage
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TENTATIVAS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_LEASE = 300  # segundos até uma tarefa "executando" ser considerada abandonada
+JOB_RETENCAO = int(os.getenv("JOB_RETENTION_DAYS", "7")) * 86400  # tarefas "feito" mais velhas saem da tabela
+
+TAREFAS = {}
+TEMPORARIOS = {}  # tipo -> campos do payload que são arquivos locais descartáveis
+_fila_podada = {"pid": None, "em": 0}
+_fila_con = {"pid": None, "con": None}
+_fila_con_lock = threading.Lock()
+_fila_pid = None
+_fila_lock = threading.Lock()
+
+# Métricas: histogramas por processo, agregados entre workers via arquivos em METRICS_DIR
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "galeria_privada_metrics"))
+METRICS_FLUSH = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metricas = {"histogramas": {}, "contadores": {}}
+_metricas_lock = threading.Lock()
+_metricas_gravadas = 0.0
+
+def observar(nome, labels, segundos):
+    """Registra uma duração no histograma nome{labels}"""
+    chave = (nome, tuple(sorted(labels.items())))
+    with _metricas_lock:
+        h = _metricas["histogramas"].get(chave)
+        if h is None:
+            h = _metricas["histogramas"][chave] = {"buckets": [0] * len(BUCKETS), "soma": 0.0, "total": 0}
+        indice = bisect.bisect_left(BUCKETS, segundos)
+        if indice < len(BUCKETS):
+            h["buckets"][indice] += 1
+        h["soma"] += segundos
+        h["total"] += 1
+
+def incrementar(nome, labels, valor=1):
+    """Soma valor ao contador nome{labels}"""
+    chave = (nome, tuple(sorted(labels.items())))
+    with _metricas_lock:
+        _metricas["contadores"][chave] = _metricas["contadores"].get(chave, 0) + valor
+
+def tempo_request(nome, segundos):
+    """Acumula a duração no cabeçalho Server-Timing da requisição atual, se houver uma"""
+    if has_request_context():
+        tempos = g.setdefault("server_timing", {})
+        tempos[nome] = tempos.get(nome, 0.0) + segundos
+
+@contextmanager
+def etapa(nome):
+    """Mede um trecho do processamento (multipart, json, ...) no histograma e no Server-Timing"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracao = time.perf_counter() - inicio
+        observar("galeria_etapa_seconds", {"etapa": nome}, duracao)
+        tempo_request(nome, duracao)
+
+def rotulos_supabase(url):
+    """Classifica a chamada: serviço (postgrest, rpc, storage, storage_tus) e alvo (tabela, função ou bucket)"""
+    partes = url.path.split("/")
+    if url.path.startswith("/rest/v1/rpc/"):
+        return "rpc", partes[4]
+    if url.path.startswith("/rest/v1/"):
+        return "postgrest", partes[3]
+    if url.path.startswith("/storage/v1/upload/resumable"):
+        return "storage_tus", BUCKET_NAME
+    if url.path.startswith("/storage/v1/object/"):
+        alvo = partes[5] if len(partes) > 5 and partes[4] in ("public", "sign", "info", "list") else partes[4]
+        return "storage", alvo
+    return "outro", url.host
+
+class TransporteMedido(httpx.BaseTransport):
+    """Envolve o transporte do httpx: toda chamada ao Supabase gera tempo, bytes e erros"""
+
+    def __init__(self, transporte):
+        self._transporte = transporte
+
+    def handle_request(self, req):
+        servico, alvo = rotulos_supabase(req.url)
+        labels = {"servico": servico, "alvo": alvo, "metodo": req.method}
+        inicio = time.perf_counter()
+        try:
+            resposta = self._transporte.handle_request(req)
+        except Exception:
+            incrementar("galeria_supabase_errors_total", labels)
+            raise
+        finally:
+            duracao = time.perf_counter() - inicio
+            observar("galeria_supabase_request_seconds", labels, duracao)
+            tempo_request(servico, duracao)
+        if resposta.status_code >= 400:
+            incrementar("galeria_supabase_errors_total", labels)
+        incrementar("galeria_supabase_bytes_sent_total", labels, int(req.headers.get("content-length") or 0))
+        incrementar("galeria_supabase_bytes_received_total", labels, int(resposta.headers.get("content-length") or 0))
+        return resposta
+
+    def close(self):
+        self._transporte.close()
+
+def gravar_metricas(forcar=False):
+    """Grava o retrato deste processo em METRICS_DIR/<pid>.json (no máximo a cada METRICS_FLUSH s)"""
+    global _metricas_gravadas
+    agora = time.monotonic()
+    if not forcar and agora - _metricas_gravadas < METRICS_FLUSH:
+        return
+    _metricas_gravadas = agora
+    with _metricas_lock:
+        retrato = {
+            "histogramas": [[n, list(l), h] for (n, l), h in _metricas["histogramas"].items()],
+            "contadores": [[n, list(l), v] for (n, l), v in _metricas["contadores"].items()],
+        }
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    destino = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    with open(destino + ".tmp", "w") as f:
+        json.dump(retrato, f)
+    os.replace(destino + ".tmp", destino)
+
+def texto_prometheus():
+    """Soma os retratos de todos os workers e formata no padrão de exposição do Prometheus"""
+    histogramas, contadores = {}, {}
+    for arquivo in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+        try:
+            with open(arquivo) as f:
+                retrato = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for nome, labels, h in retrato["histogramas"]:
+            atual = histogramas.setdefault((nome, tuple(map(tuple, labels))), {"buckets": [0] * len(BUCKETS), "soma": 0.0, "total": 0})
+            atual["buckets"] = [a + b for a, b in zip(atual["buckets"], h["buckets"])]
+            atual["soma"] += h["soma"]
+            atual["total"] += h["total"]
+        for nome, labels, valor in retrato["contadores"]:
+            chave = (nome, tuple(map(tuple, labels)))
+            contadores[chave] = contadores.get(chave, 0) + valor
+
+    def formatar(labels, extra=()):
+        pares = [*labels, *extra]
+        return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}" if pares else ""
+
+    linhas, declarados = [], set()
+    for (nome, labels), h in sorted(histogramas.items()):
+        if nome not in declarados:
+            linhas.append(f"# TYPE {nome} histogram")
+            declarados.add(nome)
+        acumulado = 0
+        for limite, n in zip(BUCKETS, h["buckets"]):
+            acumulado += n
+            linhas.append(f"{nome}_bucket{formatar(labels, [('le', limite)])} {acumulado}")
+        linhas.append(f"{nome}_bucket{formatar(labels, [('le', '+Inf')])} {h['total']}")
+        linhas.append(f"{nome}_sum{formatar(labels)} {h['soma']}")
+        linhas.append(f"{nome}_count{formatar(labels)} {h['total']}")
+    for (nome, labels), valor in sorted(contadores.items()):
+        if nome not in declarados:
+            linhas.append(f"# TYPE {nome} counter")
+            declarados.add(nome)
+        linhas.append(f"{nome}{formatar(labels)} {valor}")
+    return "\n".join(linhas) + "\n"
+
+def sessao_http(**kwargs):
+    """Cria um httpx.Client com os limites de pool e keep-alive da aplicação, com chamadas medidas"""
+    transporte = httpx.HTTPTransport(
+        http2=HTTP2,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONEXOES,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=30,
+        ),
+    )
+    return httpx.Client(timeout=HTTP_TIMEOUT, transport=TransporteMedido(transporte), **kwargs)
+
+def afinar_sessao(sessao):
+    """Troca a sessão padrão do postgrest/storage3 por uma com o pool afinado, mantendo URL e cabeçalhos"""
+    return sessao_http(base_url=sessao.base_url, headers=sessao.headers, follow_redirects=True)
+
+class ClienteSupabase:
+    """Só as partes do supabase-py que o app usa: PostgREST (table/rpc) e Storage, este criado no primeiro acesso.
+    Montado direto sobre postgrest e storage3: o pacote supabase importaria também gotrue e realtime."""
+
+    def __init__(self):
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise RuntimeError("SUPABASE_URL e SUPABASE_KEY precisam estar configuradas")
+        from postgrest import SyncPostgrestClient
+
+        self.cabecalhos = {"apiKey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"}
+        self.postgrest = SyncPostgrestClient(f"{SUPABASE_URL}/rest/v1", headers=self.cabecalhos, timeout=HTTP_TIMEOUT)
+        # O cliente não aceita um httpx.Client externo; substitui a sessão interna
+        if hasattr(self.postgrest, "session"):
+            self.postgrest.session = afinar_sessao(self.postgrest.session)
+        self._storage = None
+        self._lock = threading.Lock()
+
+    def table(self, nome):
+        return self.postgrest.from_(nome)
+
+    def rpc(self, funcao, params=None):
+        return self.postgrest.rpc(funcao, params or {})
+
+    @property
+    def storage(self):
+        if self._storage is None:
+            with self._lock:
+                if self._storage is None:
+                    from storage3 import SyncStorageClient
+
+                    storage = SyncStorageClient(f"{SUPABASE_URL}/storage/v1", self.cabecalhos, int(HTTP_TIMEOUT))
+                    if hasattr(storage, "_client"):
+                        storage._client = afinar_sessao(storage._client)
+                    self._storage = storage
+        return self._storage
+
+def cliente_processo(nome, criar):
+    """Objeto nome deste processo, criado por criar() na primeira chamada após o fork"""
+    pid = os.getpid()
+    clientes = _clientes.get(pid, {})
+    if nome not in clientes:
+        with _clientes_lock:
+            if pid not in _clientes:
+                # Nunca reaproveita conexões herdadas do processo pai
+                _clientes.clear()
+                _clientes[pid] = {}
+            clientes = _clientes[pid]
+            if nome not in clientes:
+                clientes[nome] = criar()
+    return clientes[nome]
+
+def cliente_supabase() -> ClienteSupabase:
+    """Cliente Supabase do processo atual"""
+    return cliente_processo("supabase", ClienteSupabase)
+
+def cliente_http() -> httpx.Client:
+    """httpx.Client compartilhado do processo atual, para chamadas diretas às APIs do Supabase"""
+    return cliente_processo("http", sessao_http)
+
+class ArquivoComHash:
+    """Arquivo temporário nomeado que calcula o SHA-256 enquanto o Werkzeug grava o upload"""
+    def __init__(self):
+        self._arquivo = tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, prefix="upload_")
+        self.sha256 = hashlib.sha256()
+
+    def write(self, dados):
+        self.sha256.update(dados)
+        return self._arquivo.write(dados)
+
+    def __getattr__(self, nome):
+        return getattr(self._arquivo, nome)
+
+class RequestEmDisco(Request):
+    """Grava os arquivos do multipart direto num arquivo temporário nomeado, nunca em memória"""
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return ArquivoComHash()
+
+    @property
+    def max_content_length(self):
+        # O envio em lote aceita um corpo maior; cada arquivo continua limitado a MAX_UPLOAD_MB
+        if self.path == "/api/upload/batch":
+            return MAX_BATCH_MB * 1024 * 1024
+        # Partes do upload retomável: cada request é curto e limitado
+        if self.path.startswith("/api/uploads/") and "/parts/" in self.path:
+            return TAMANHO_PARTE_UPLOAD
+        return app.config["MAX_CONTENT_LENGTH"]
+
+app.request_class = RequestEmDisco
+
+# Painel administrativo: arquivos estáticos gerados pelo build_assets.py
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+DIST_DIR = os.path.join(STATIC_DIR, "dist")
+PAGINA_FONTE = os.path.join(STATIC_DIR, "src", "admin.html")
+ASSETS_MAX_AGE = 365 * 24 * 3600
+
+class RequisicaoInvalida(Exception):
+    """Erro de parâmetro enviado pelo cliente (vira HTTP 400)"""
+
+class ImagemDuplicada(Exception):
+    """A mesma imagem (mesmo conteúdo) já está cadastrada nesta tabela (vira HTTP 409)"""
+    def __init__(self, nome_arquivo):
+        super().__init__("Imagem já cadastrada")
+        self.nome_arquivo = nome_arquivo
+
+class TokenExpirado(Exception):
+    """Token since mais velho que a retenção das lápides: o consumidor precisa recarregar tudo (vira HTTP 410)"""
+
+class UploadNaoEncontrado(Exception):
+    """Sessão de upload em partes inexistente, expirada ou já finalizada (vira HTTP 404)"""
+
+@app.errorhandler(RequisicaoInvalida)
+def requisicao_invalida(erro):
+    return jsonify({"error": str(erro)}), 400
+
+@app.errorhandler(ImagemDuplicada)
+def imagem_duplicada(erro):
+    return jsonify({"error": str(erro), "name": erro.nome_arquivo}), 409
+
+@app.errorhandler(UploadNaoEncontrado)
+def upload_nao_encontrado(erro):
+    return jsonify({"error": "Upload não encontrado ou expirado"}), 404
+
+@app.errorhandler(TokenExpirado)
+def token_expirado(erro):
+    return jsonify({"error": "Token since expirado: recarregue tudo sem since", "resync": True}), 410
+
+@app.errorhandler(RequestEntityTooLarge)
+def arquivo_grande_demais(erro):
+    return jsonify({"error": f"Arquivo maior que o limite de {MAX_UPLOAD_MB} MB"}), 413
 
 def limpar_nome_arquivo(nome):
     """Remove acentos e caracteres especiais dos nomes dos arquivos"""
@@ -25,455 +451,1774 @@ def limpar_nome_arquivo(nome):
     nome = re.sub(r'[^a-zA-Z0-9._-]', '_', nome)
     return nome
 
-def upload_imagem_supabase(file, prefixo):
-    """Faz o upload para o storage e retorna o nome final e a URL pública"""
-    nome_final = f"{prefixo}_{int(time.time())}_{limpar_nome_arquivo(file.filename)}"
-    supabase.storage.from_(BUCKET_NAME).upload(
-        path=nome_final, 
-        file=file.read(), 
-        file_options={"content-type": file.content_type}
+def normalizar_tag(tag):
+    """Mesma dobra de acentos do limpar_nome_arquivo, em minúsculas (ex.: ' Preços ' -> 'precos')"""
+    tag = unicodedata.normalize('NFKD', tag).encode('ascii', 'ignore').decode('ascii').lower()
+    tag = re.sub(r'[^a-z0-9 _-]', '', tag)
+    return re.sub(r'\s+', ' ', tag).strip()
+
+def campos_tags(tags):
+    """Colunas gravadas junto com o texto livre de tags: o array indexado (GIN) e o texto de busca"""
+    normalizadas = sorted({t for t in (normalizar_tag(t) for t in (tags or '').split(',')) if t})
+    return {"tags": tags, "tags_norm": normalizadas, "tags_busca": " ".join(normalizadas)}
+
+@contextmanager
+def arquivo_em_disco(file):
+    """Garante um caminho local e o SHA-256 do arquivo enviado, copiando em blocos quando necessário"""
+    stream = file.stream
+    if isinstance(stream, ArquivoComHash):
+        stream.flush()
+        yield stream.name, stream.sha256.hexdigest()
+        return
+
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, prefix="upload_") as tmp:
+        total, sha256 = 0, hashlib.sha256()
+        while bloco := stream.read(TAMANHO_BLOCO):
+            total += len(bloco)
+            if total > app.config["MAX_CONTENT_LENGTH"]:
+                raise RequestEntityTooLarge()
+            sha256.update(bloco)
+            tmp.write(bloco)
+        tmp.flush()
+        yield tmp.name, sha256.hexdigest()
+
+@contextmanager
+def sem_metadados(caminho, digest):
+    """Versão do arquivo que vai para o storage: sem EXIF/XMP (GPS, câmera, data), já que o original é público.
+    Quando há o que remover, o nome passa a ser o hash da versão regravada."""
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, prefix="limpo_") as tmp:
+        if not pool_imagens().submit(remover_metadados, caminho, tmp.name).result():
+            yield caminho, digest
+            return
+        sha256 = hashlib.sha256()
+        while bloco := tmp.read(TAMANHO_BLOCO):
+            sha256.update(bloco)
+        yield tmp.name, sha256.hexdigest()
+
+def ler_blocos(f, inicio, tamanho):
+    """Gera o trecho [inicio, inicio + tamanho) do arquivo em blocos pequenos"""
+    f.seek(inicio)
+    restante = tamanho
+    while restante > 0:
+        bloco = f.read(min(TAMANHO_BLOCO, restante))
+        if not bloco:
+            break
+        restante -= len(bloco)
+        yield bloco
+
+def upload_resumable(caminho, nome_final, content_type, tamanho):
+    """Envia arquivos grandes pelo endpoint TUS do Supabase, em partes de 6 MB com retomada"""
+    def b64(valor):
+        return base64.b64encode(valor.encode()).decode()
+
+    cabecalhos = {"authorization": f"Bearer {SUPABASE_KEY}", "apikey": SUPABASE_KEY, "tus-resumable": "1.0.0"}
+    endpoint = f"{SUPABASE_URL}/storage/v1/upload/resumable"
+    http = cliente_http()
+    # 1. Cria a sessão de upload
+    criado = http.post(endpoint, headers={
+        **cabecalhos,
+        "upload-length": str(tamanho),
+        "upload-metadata": ",".join([
+            f"bucketName {b64(BUCKET_NAME)}",
+            f"objectName {b64(nome_final)}",
+            f"contentType {b64(content_type or 'application/octet-stream')}",
+        ]),
+        "x-upsert": "true",
+    })
+    criado.raise_for_status()
+    destino = urljoin(endpoint, criado.headers["location"])
+
+    # 2. Envia as partes; em caso de falha pergunta o offset ao servidor e retoma dali
+    #    (a consulta do offset também conta como tentativa: pode falhar pelo mesmo motivo)
+    offset, falhas, retomar = 0, 0, False
+    with open(caminho, "rb") as f:
+        while offset < tamanho:
+            parte = min(TAMANHO_PARTE_TUS, tamanho - offset)
+            try:
+                if retomar:
+                    r = http.head(destino, headers=cabecalhos)
+                    r.raise_for_status()
+                    offset, retomar = int(r.headers["upload-offset"]), False
+                    continue
+                r = http.patch(destino, content=ler_blocos(f, offset, parte), headers={
+                    **cabecalhos,
+                    "upload-offset": str(offset),
+                    "content-type": "application/offset+octet-stream",
+                    "content-length": str(parte),
+                })
+                r.raise_for_status()
+                offset = int(r.headers["upload-offset"])
+            except (httpx.HTTPError, KeyError, ValueError):
+                falhas += 1
+                if falhas >= TENTATIVAS_UPLOAD:
+                    raise
+                time.sleep(falhas)
+                retomar = True
+
+def preservar_original(caminho):
+    """Cria um segundo nome para o arquivo temporário, que sobrevive ao fim da requisição"""
+    copia = f"{caminho}.orig"
+    try:
+        os.link(caminho, copia)
+    except OSError:
+        shutil.copyfile(caminho, copia)
+    return copia
+
+def descartar_original(original):
+    """Remove a cópia local do original quando a gravação não foi até o fim"""
+    try:
+        os.remove(original)
+    except FileNotFoundError:
+        pass
+
+def nome_por_conteudo(digest, file):
+    """Chave no storage derivada do conteúdo: o mesmo arquivo sempre gera o mesmo nome"""
+    extensao = os.path.splitext(limpar_nome_arquivo(file.filename or ""))[1].lower()
+    if extensao in (".jpeg", ".jpe"):
+        extensao = ".jpg"
+    if not extensao:
+        extensao = mimetypes.guess_extension(file.content_type or "") or ""
+    return f"{digest}{extensao}"
+
+def referencias_blob(nome_arquivo):
+    """Quantas linhas (galeria + promoções) apontam para este arquivo do storage"""
+    return cliente_supabase().rpc("blob_referencias", {"p_nome": nome_arquivo}).execute().data or 0
+
+def upload_imagem_supabase(file, tabela):
+    """Faz o upload para o storage e retorna o nome final, a URL pública e uma cópia local do original
+
+    O nome é o SHA-256 do conteúdo: se outra linha já usa os mesmos bytes, a transferência é pulada.
+    """
+    with arquivo_em_disco(file) as (caminho, digest), sem_metadados(caminho, digest) as (caminho, digest):
+        nome_final = nome_por_conteudo(digest, file)
+        if cliente_supabase().table(tabela).select("nome_arquivo").eq("nome_arquivo", nome_final).execute().data:
+            raise ImagemDuplicada(nome_final)
+
+        original = preservar_original(caminho)
+        try:
+            if referencias_blob(nome_final) == 0:
+                tamanho = os.path.getsize(caminho)
+                if tamanho > LIMITE_RESUMABLE:
+                    upload_resumable(caminho, nome_final, file.content_type, tamanho)
+                else:
+                    # O storage3 repassa o arquivo aberto ao httpx, que o lê em blocos
+                    with open(caminho, "rb") as f:
+                        cliente_supabase().storage.from_(BUCKET_NAME).upload(
+                            path=nome_final,
+                            file=f,
+                            # upsert: o blob pode ter sobrado de uma linha apagada ainda não coletada
+                            file_options={"content-type": file.content_type, "upsert": "true"}
+                        )
+        except BaseException:
+            descartar_original(original)
+            raise
+    url = cliente_supabase().storage.from_(BUCKET_NAME).get_public_url(nome_final)
+    return nome_final, url, original
+
+def trocar_imagem(tabela, old_name, file):
+    """Sobe a imagem nova da edição; None quando não há arquivo ou é o mesmo conteúdo"""
+    if file is None:
+        return None
+    try:
+        return upload_imagem_supabase(file, tabela)
+    except ImagemDuplicada as erro:
+        if erro.nome_arquivo == old_name:
+            return None
+        raise
+
+# --- UPLOAD RETOMÁVEL EM PARTES (/api/uploads) ---
+
+def objeto_upload(upload_id, nome=""):
+    """Caminho no bucket de um arquivo da sessão (ou da pasta da sessão, sem nome)"""
+    return f"{UPLOAD_PREFIXO}/{upload_id}/{nome}".rstrip("/")
+
+def upload_expirado(upload_id):
+    """O id começa pela hora de criação (hexadecimal); ids fora desse formato contam como expirados"""
+    try:
+        criado = int(upload_id.split("-", 1)[0], 16)
+    except ValueError:
+        return True
+    return criado < time.time() - UPLOAD_SESSAO_TTL
+
+def ler_sessao_upload(upload_id):
+    """meta.json da sessão; UploadNaoEncontrado se o id é inválido, expirou ou já foi apagado"""
+    if not re.fullmatch(r"[0-9a-f]{8}-[A-Za-z0-9_-]{16,64}", upload_id or "") or upload_expirado(upload_id):
+        raise UploadNaoEncontrado()
+    meta = io.BytesIO()
+    if not baixar_objeto(objeto_upload(upload_id, "meta.json"), meta):
+        raise UploadNaoEncontrado()
+    return json.loads(meta.getvalue())
+
+def listar_objetos(pasta):
+    """Nomes dentro de uma pasta do bucket, paginando a listagem do storage"""
+    offset = 0
+    while True:
+        objetos = cliente_supabase().storage.from_(BUCKET_NAME).list(pasta, {"limit": 1000, "offset": offset})
+        yield from (o["name"] for o in objetos)
+        if len(objetos) < 1000:
+            return
+        offset += len(objetos)
+
+def partes_recebidas(upload_id):
+    """Partes já gravadas no bucket; uma parte só aparece depois de inteira no storage"""
+    return sorted(int(nome[:-len(".part")]) for nome in listar_objetos(objeto_upload(upload_id)) if nome.endswith(".part"))
+
+def tamanho_parte(meta, parte):
+    """Bytes esperados na parte (a última pode ser menor)"""
+    return min(meta["part_size"], meta["size"] - parte * meta["part_size"])
+
+def gravar_sessao_upload(upload_id, meta):
+    """Grava (ou regrava) o meta.json da sessão, que guarda também o estado da finalização"""
+    cliente_supabase().storage.from_(BUCKET_NAME).upload(
+        path=objeto_upload(upload_id, "meta.json"),
+        file=json.dumps(meta).encode(),
+        file_options={"content-type": "application/json", "upsert": "true"}
+    )
+
+def arquivo_montado(upload_id, meta):
+    """Junta as partes (em ordem, baixadas do bucket bloco a bloco) num ArquivoComHash, como se viesse do multipart"""
+    destino = ArquivoComHash()
+    for parte in range(meta["parts"]):
+        if not baixar_objeto(objeto_upload(upload_id, f"{parte}.part"), destino):
+            destino.close()
+            raise UploadNaoEncontrado()
+    destino.flush()
+    destino.seek(0)
+    return FileStorage(stream=destino, filename=meta["filename"], content_type=meta["content_type"])
+
+def upload_id_do_formulario():
+    """upload_id de um envio em partes, quando o formulário veio sem o arquivo (campo image)"""
+    if 'image' in request.files:
+        return None
+    return request.form.get('upload_id') or None
+
+def iniciar_finalizacao(upload_id, acao, **campos):
+    """Confere que todas as partes chegaram e enfileira a montagem + gravação (acao em GRAVACOES).
+    Pedir de novo uma finalização em andamento ou concluída não repete o trabalho; depois de um erro, tenta outra vez."""
+    meta = ler_sessao_upload(upload_id)
+    if meta.get("status", "recebendo") in ("recebendo", "erro"):
+        faltam = meta["parts"] - len(partes_recebidas(upload_id))
+        if faltam:
+            raise RequisicaoInvalida(f"Upload incompleto: faltam {faltam} partes")
+        meta = {**meta, "status": "processando", "acao": acao, "campos": campos}
+        meta.pop("error", None)
+        gravar_sessao_upload(upload_id, meta)
+        enfileirar("finalizar_upload", chave=f"finalizar:{upload_id}", upload_id=upload_id)
+    return meta
+
+def agendar_finalizacao(upload_id, acao, **campos):
+    """Resposta 202 da finalização: o painel acompanha o resultado em GET /api/uploads/<id>"""
+    meta = iniciar_finalizacao(upload_id, acao, **campos)
+    resposta = jsonify({"status": meta["status"], "upload_id": upload_id})
+    resposta.status_code = 202
+    resposta.headers["Location"] = f"/api/uploads/{upload_id}"
+    return resposta
+
+def nome_variante(nome_arquivo, tamanho, formato):
+    """Nome no storage de uma variante (ex.: <sha256>_thumb.webp)"""
+    base = nome_arquivo.rsplit(".", 1)[0]
+    return f"{base}_{tamanho}.{formato}"
+
+def nomes_variantes(nome_arquivo):
+    """Todos os nomes de variante possíveis para um arquivo (usado na remoção)"""
+    return [nome_variante(nome_arquivo, t, f) for t in VARIANTES for f in FORMATOS_PIL]
+
+@cache
+def formatos_suportados():
+    """Formatos que o Pillow deste processo consegue gravar (AVIF depende do build)"""
+    from PIL import features
+    return [f for f in FORMATOS_PIL if f != "avif" or features.check("avif")]
+
+def gerar_variantes(caminho):
+    """Roda no pool de processos: corrige a orientação, remove o EXIF e grava cada tamanho/formato em disco"""
+    from PIL import Image, ImageOps
+
+    formatos = formatos_suportados()
+    saidas = []
+    with Image.open(caminho) as aberta:
+        imagem = ImageOps.exif_transpose(aberta)
+        if imagem.mode not in ("RGB", "RGBA"):
+            imagem = imagem.convert("RGBA" if "transparency" in imagem.info else "RGB")
+        for tamanho, lado in VARIANTES.items():
+            reduzida = imagem.copy()
+            reduzida.thumbnail((lado, lado), Image.LANCZOS)
+            for formato in formatos:
+                saida = reduzida.convert("RGB") if formato == "jpeg" else reduzida
+                destino = f"{caminho}_{tamanho}.{formato}"
+                # Sem o parâmetro exif o Pillow não regrava os metadados
+                saida.save(destino, FORMATOS_PIL[formato], quality=QUALIDADE[formato])
+                saidas.append((tamanho, formato, destino, reduzida.width))
+    return saidas
+
+def remover_metadados(origem, destino):
+    """Roda no pool de processos: regrava em destino com a orientação aplicada e sem EXIF/XMP.
+    False se não há metadados ou o arquivo não é uma imagem estática regravável: vale o original."""
+    from PIL import Image, ImageOps, JpegImagePlugin, UnidentifiedImageError
+
+    try:
+        aberta = Image.open(origem)
+    except UnidentifiedImageError:
+        return False
+    with aberta:
+        formato = aberta.format
+        if formato not in ("JPEG", "PNG", "WEBP") or getattr(aberta, "n_frames", 1) > 1:
+            return False
+        if not aberta.getexif() and not aberta.info.keys() & {"exif", "xmp", "XML:com.adobe.xmp"}:
+            return False
+        opcoes = {"icc_profile": aberta.info.get("icc_profile")}
+        if formato == "JPEG":
+            # Mesmas tabelas de quantização e subamostragem: a regravação quase não perde qualidade
+            opcoes.update(qtables=aberta.quantization, subsampling=JpegImagePlugin.get_sampling(aberta))
+        elif formato == "WEBP":
+            opcoes.update(quality=QUALIDADE["webp"])
+        imagem = ImageOps.exif_transpose(aberta)
+        for chave in ("exif", "xmp", "XML:com.adobe.xmp"):
+            imagem.info.pop(chave, None)
+        imagem.save(destino, formato, **opcoes)
+    return True
+
+def redimensionar_imagem(origem, destino, largura, formato, qualidade):
+    """Roda no pool de processos: uma versão do original com no máximo largura px (sem ampliar)"""
+    from PIL import Image, ImageOps
+
+    with Image.open(origem) as aberta:
+        imagem = ImageOps.exif_transpose(aberta)
+        if imagem.mode not in ("RGB", "RGBA"):
+            imagem = imagem.convert("RGBA" if "transparency" in imagem.info else "RGB")
+        if imagem.width > largura:
+            imagem = imagem.resize((largura, max(1, round(imagem.height * largura / imagem.width))), Image.LANCZOS)
+        if formato == "jpeg":
+            imagem = imagem.convert("RGB")
+        imagem.save(destino, FORMATOS_PIL[formato], quality=qualidade)
+
+def pool_imagens():
+    """Pool de processos deste worker para o trabalho de CPU, criado após o fork"""
+    pid = os.getpid()
+    with _pools_lock:
+        if pid not in _pools:
+            _pools.clear()
+            # spawn: o filho não herda threads, greenlets nem conexões do worker
+            _pools[pid] = ProcessPoolExecutor(
+                max_workers=IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pools[pid]
+
+# --- FILA DE TAREFAS ---
+
+@contextmanager
+def conexao_fila():
+    """Conexão SQLite do processo, criada com o schema uma única vez após o fork.
+    Compartilhada por threads e greenlets: o lock deixa um comando por vez."""
+    with _fila_con_lock:
+        if _fila_con["pid"] != os.getpid():
+            _fila_con.update(con=abrir_fila(), pid=os.getpid())
+        yield _fila_con["con"]
+
+def abrir_fila():
+    """Abre o banco da fila e garante a tabela e o índice"""
+    con = sqlite3.connect(JOBS_DB, timeout=30, isolation_level=None, check_same_thread=False)
+    con.execute("pragma journal_mode=wal")
+    con.execute("""
+        create table if not exists jobs (
+            id integer primary key,
+            chave text not null unique,
+            tipo text not null,
+            payload text not null,
+            estado text not null default 'pendente',
+            tentativas integer not null default 0,
+            executar_em real not null,
+            erro text,
+            criado_em real not null
+        )
+    """)
+    con.execute("create index if not exists jobs_fila on jobs (estado, executar_em)")
+    return con
+
+def tarefa(tipo, temporarios=()):
+    """Registra a função que executa as tarefas de um tipo; temporarios são os campos do payload
+    com arquivos locais que a fila apaga quando a tarefa é descartada, substituída ou falha de vez"""
+    def registrar(funcao):
+        TAREFAS[tipo] = funcao
+        TEMPORARIOS[tipo] = temporarios
+        return funcao
+    return registrar
+
+def descartar_temporarios(tipo, payload, manter=()):
+    """Apaga os arquivos locais do payload que ninguém mais vai usar"""
+    for campo in TEMPORARIOS.get(tipo, ()):
+        caminho = payload.get(campo)
+        if caminho and caminho not in manter:
+            descartar_original(caminho)
+
+def enfileirar(tipo, chave=None, atraso=0, **payload):
+    """Grava a tarefa na fila; enquanto houver uma tarefa com a mesma chave em aberto, não duplica.
+    Uma pendente recebe o payload novo (sem adiar a execução); uma em execução já cobre o pedido."""
+    corpo = json.dumps(payload, sort_keys=True)
+    chave = chave or hashlib.sha1(f"{tipo}:{corpo}".encode()).hexdigest()
+    agora = time.time()
+    with conexao_fila() as con:
+        con.execute("begin immediate")
+        try:
+            atual = con.execute("select estado, payload from jobs where chave = ?", (chave,)).fetchone()
+            if atual is None:
+                con.execute("insert into jobs (chave, tipo, payload, executar_em, criado_em) values (?, ?, ?, ?, ?)",
+                            (chave, tipo, corpo, agora + atraso, agora))
+            elif atual[0] != "executando":
+                con.execute("""
+                    update jobs set payload = ?, estado = 'pendente', tentativas = 0, erro = null,
+                        executar_em = case when estado = 'pendente' then min(executar_em, ?) else ? end
+                    where chave = ?
+                """, (corpo, agora + atraso, agora + atraso, chave))
+            con.execute("commit")
+        except BaseException:
+            con.execute("rollback")
+            raise
+    if atual is not None and atual[0] == "executando":
+        descartar_temporarios(tipo, payload)
+    elif atual is not None and atual[0] == "pendente":
+        descartar_temporarios(tipo, json.loads(atual[1]), manter=payload.values())
+    iniciar_fila()
+
+def reservar_tarefa():
+    """Pega a próxima tarefa vencida (ou abandonada por um worker que morreu) de forma atômica"""
+    agora = time.time()
+    with conexao_fila() as con:
+        return con.execute("""
+            update jobs set estado = 'executando', tentativas = tentativas + 1, executar_em = ?
+            where id = (
+                select id from jobs
+                where estado in ('pendente', 'executando') and executar_em <= ?
+                order by executar_em limit 1
+            )
+            returning id, tipo, payload, tentativas
+        """, (agora + JOB_LEASE, agora)).fetchone()
+
+def executar_fila():
+    """Laço das threads de trabalho: nenhum erro (nem do SQLite) pode matar a thread"""
+    while True:
+        try:
+            executou = executar_proxima()
+            if not executou:
+                podar_fila()
+        except Exception as erro:
+            # Uma tarefa que ficou "executando" volta para a fila quando o lease vencer
+            app.logger.warning("Fila: erro ao reservar ou atualizar tarefa: %r", erro)
+            executou = False
+        if not executou:
+            time.sleep(1)
+
+def podar_fila():
+    """Apaga as tarefas concluídas há mais de JOB_RETENCAO, no máximo uma vez por hora por processo"""
+    agora = time.time()
+    if _fila_podada["pid"] == os.getpid() and agora - _fila_podada["em"] < 3600:
+        return
+    _fila_podada.update(pid=os.getpid(), em=agora)
+    with conexao_fila() as con:
+        con.execute("delete from jobs where estado = 'feito' and executar_em < ?", (agora - JOB_RETENCAO,))
+
+def executar_proxima():
+    """Executa a próxima tarefa vencida e reprograma com backoff ou marca como falha; False se não havia nenhuma"""
+    job = reservar_tarefa()
+    if not job:
+        return False
+
+    job_id, tipo, payload, tentativas = job
+    try:
+        TAREFAS[tipo](**json.loads(payload))
+    except Exception as erro:
+        if tentativas >= JOB_TENTATIVAS:
+            estado, executar_em = "falhou", time.time()
+        else:
+            estado, executar_em = "pendente", time.time() + 2 ** tentativas
+        with conexao_fila() as con:
+            con.execute(
+                "update jobs set estado = ?, executar_em = ?, erro = ? where id = ?",
+                (estado, executar_em, repr(erro), job_id),
+            )
+        if estado == "falhou":
+            descartar_temporarios(tipo, json.loads(payload))
+        app.logger.warning("Tarefa %s (%s) falhou: %r", job_id, tipo, erro)
+    else:
+        with conexao_fila() as con:
+            con.execute("update jobs set estado = 'feito', erro = null where id = ?", (job_id,))
+    return True
+
+def iniciar_fila():
+    """Sobe as threads de trabalho uma única vez por processo (seguro após o fork do gunicorn)"""
+    global _fila_pid
+    if _fila_pid == os.getpid():
+        return
+    with _fila_lock:
+        if _fila_pid == os.getpid():
+            return
+        for i in range(JOB_WORKERS):
+            threading.Thread(target=executar_fila, name=f"fila-{i}", daemon=True).start()
+        _fila_pid = os.getpid()
+
+@tarefa("remover_storage")
+def remover_storage(nomes):
+    """Remove objetos do bucket em lotes do limite da API; remover algo que já não existe não é erro"""
+    for lote in em_lotes(nomes, STORAGE_REMOVE_LOTE):
+        cliente_supabase().storage.from_(BUCKET_NAME).remove(lote)
+
+def blob_recente(nome_arquivo):
+    """True se o blob foi gravado há menos de BLOB_GC_DELAY: pode ser um upload com a linha ainda a caminho
+    (referencias_blob deu 0 antes do envio e o insert vem depois)"""
+    objetos = cliente_supabase().storage.from_(BUCKET_NAME).list("", {"search": nome_arquivo, "limit": 10})
+    for objeto in objetos:
+        if objeto["name"] == nome_arquivo and objeto.get("updated_at"):
+            gravado = datetime.fromisoformat(objeto["updated_at"])
+            return (datetime.now(timezone.utc) - gravado).total_seconds() < BLOB_GC_DELAY
+    return False
+
+def coletar_livres(nomes):
+    """Apaga os blobs sem referência e suas variantes; os gravados há pouco são conferidos de novo mais tarde"""
+    recentes = [nome for nome in nomes if blob_recente(nome)]
+    for nome in recentes:
+        # A tarefa em execução ainda ocupa a própria chave: cada nova conferência leva o horário previsto
+        enfileirar("coletar_blob", chave=f"coletar:{nome}:{int(time.time()) + BLOB_GC_DELAY}",
+                   atraso=BLOB_GC_DELAY, nome_arquivo=nome)
+    remover_storage([objeto for nome in nomes if nome not in recentes for objeto in (nome, *nomes_variantes(nome))])
+
+@tarefa("coletar_blob")
+def coletar_blob(nome_arquivo):
+    """Apaga o blob e as variantes só se nenhuma linha voltou a referenciá-lo"""
+    if referencias_blob(nome_arquivo) > 0:
+        return
+    coletar_livres([nome_arquivo])
+
+@tarefa("coletar_blobs")
+def coletar_blobs(nomes):
+    """Versão em lote do coletar_blob: uma consulta de referências para todos os nomes"""
+    livres = cliente_supabase().rpc("blobs_sem_referencia", {"p_nomes": nomes}).execute().data
+    coletar_livres([l["nome_arquivo"] for l in livres])
+
+@tarefa("finalizar_upload")
+def finalizar_upload(upload_id):
+    """Monta o arquivo a partir das partes e faz a gravação pedida fora do request.
+    O resultado (item, duplicada, não encontrado ou erro) fica no meta.json até a limpeza por TTL."""
+    meta = ler_sessao_upload(upload_id)
+    if meta.get("status") != "processando":
+        return
+    try:
+        file = arquivo_montado(upload_id, meta)
+        try:
+            item = GRAVACOES[meta["acao"]](file, **meta["campos"])
+        finally:
+            file.close()
+        resultado = {"status": "ok", "item": item} if item else {"status": "nao_encontrado"}
+    except ImagemDuplicada as erro:
+        resultado = {"status": "duplicada", "name": erro.nome_arquivo}
+    except Exception as erro:
+        # As partes continuam no bucket: o painel pode pedir a finalização de novo
+        app.logger.warning("Finalização do upload %s falhou: %r", upload_id, erro)
+        resultado = {"status": "erro", "error": str(erro)}
+    gravar_sessao_upload(upload_id, {**meta, **resultado})
+    if resultado["status"] != "erro":
+        remover_storage([objeto_upload(upload_id, f"{parte}.part") for parte in range(meta["parts"])])
+
+@tarefa("apagar_sessao_upload")
+def apagar_sessao_upload(upload_id):
+    """Remove do bucket o meta.json e as partes da sessão"""
+    remover_storage([objeto_upload(upload_id, nome) for nome in listar_objetos(objeto_upload(upload_id))])
+
+@tarefa("limpar_sessoes_upload")
+def limpar_sessoes_upload():
+    """Apaga as sessões criadas há mais de UPLOAD_SESSAO_TTL, de qualquer dyno"""
+    for upload_id in list(listar_objetos(UPLOAD_PREFIXO)):
+        if upload_expirado(upload_id):
+            apagar_sessao_upload(upload_id)
+
+@tarefa("podar_remocoes")
+def podar_remocoes():
+    """Apaga as lápides mais velhas que a retenção do feed; tokens dessa idade recebem 410 (resync)"""
+    from postgrest.types import ReturnMethod
+
+    limite = datetime.now(timezone.utc) - timedelta(seconds=CHANGES_RETENCAO + CHANGES_SETTLE)
+    cliente_supabase().table("registro_remocoes").delete(returning=ReturnMethod.minimal) \
+        .lt("removido_em", limite.isoformat(timespec="microseconds")).execute()
+
+@tarefa("gerar_variantes", temporarios=("original",))
+def processar_variantes(tabela, nome_arquivo, original):
+    """Gera as variantes fora do processo do request, envia ao storage e grava as URLs na linha"""
+    existe = cliente_supabase().table(tabela).select("nome_arquivo").eq("nome_arquivo", nome_arquivo).execute().data
+    if not existe or not os.path.exists(original):
+        # A linha foi apagada/trocada antes de a tarefa rodar: nada a fazer
+        if os.path.exists(original):
+            os.remove(original)
+        return
+
+    # Mesmo conteúdo já processado para a outra tabela: reaproveita as variantes
+    for outra in TABELAS_COM_IMAGEM:
+        prontas = cliente_supabase().table(outra).select("variantes") \
+            .eq("nome_arquivo", nome_arquivo).not_.is_("variantes", "null").limit(1).execute().data
+        if prontas:
+            cliente_supabase().table(tabela).update({"variantes": prontas[0]["variantes"]}).eq("nome_arquivo", nome_arquivo).execute()
+            invalidar_cache()
+            os.remove(original)
+            return
+
+    variantes = {}
+    for tamanho, formato, caminho, largura in pool_imagens().submit(gerar_variantes, original).result():
+        nome = nome_variante(nome_arquivo, tamanho, formato)
+        try:
+            with open(caminho, "rb") as f:
+                # upsert: uma nova tentativa sobrescreve o que a anterior deixou pela metade
+                cliente_supabase().storage.from_(BUCKET_NAME).upload(
+                    path=nome, file=f, file_options={"content-type": f"image/{formato}", "upsert": "true"}
+                )
+        finally:
+            os.remove(caminho)
+        item = variantes.setdefault(tamanho, {"largura": largura})
+        item[formato] = cliente_supabase().storage.from_(BUCKET_NAME).get_public_url(nome)
+    cliente_supabase().table(tabela).update({"variantes": variantes}).eq("nome_arquivo", nome_arquivo).execute()
+    invalidar_cache()
+    os.remove(original)
+
+def agendar_variantes(tabela, nome_arquivo, original):
+    """Enfileira a geração das variantes sem bloquear a resposta"""
+    enfileirar("gerar_variantes", chave=f"variantes:{tabela}:{nome_arquivo}",
+               tabela=tabela, nome_arquivo=nome_arquivo, original=original)
+
+def agendar_remocao(nome_arquivo):
+    """Agenda a coleta do blob: depois de BLOB_GC_DELAY, ele sai do storage se nenhuma linha o usar"""
+    enfileirar("coletar_blob", chave=f"coletar:{nome_arquivo}", atraso=BLOB_GC_DELAY, nome_arquivo=nome_arquivo)
+
+def agendar_remocoes(nomes):
+    """agendar_remocao para vários blobs numa única tarefa"""
+    nomes = sorted(set(nomes))
+    if len(nomes) <= 1:
+        for nome in nomes:
+            agendar_remocao(nome)
+        return
+    chave = hashlib.sha1("\n".join(nomes).encode()).hexdigest()
+    enfileirar("coletar_blobs", chave=f"coletar:lote:{chave}", atraso=BLOB_GC_DELAY, nomes=nomes)
+
+# --- PROXY DE IMAGENS (/img/<nome>) ---
+
+def assinatura_img(nome, params):
+    """HMAC do nome + parâmetros (ordenados, sem o sig) com IMG_SIGNING_KEY"""
+    mensagem = f"{nome}?{urlencode(sorted(params.items()))}"
+    digest = hmac.new(IMG_SIGNING_KEY.encode(), mensagem.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+
+def url_proxy(nome, **params):
+    """URL do /img para o arquivo, assinada quando IMG_SIGNING_KEY está configurada"""
+    params = {k: str(v) for k, v in params.items() if v}
+    if IMG_SIGNING_KEY:
+        params["sig"] = assinatura_img(nome, params)
+    base = IMG_BASE_URL or (request.host_url.rstrip("/") if has_request_context() else "")
+    return f"{base}/img/{nome}" + (f"?{urlencode(params)}" if params else "")
+
+def url_original(linha):
+    """URL da imagem original nas respostas: o proxy quando IMG_PROXY=1, senão a URL pública gravada"""
+    return url_proxy(linha['nome_arquivo']) if IMG_PROXY else linha['url_imagem']
+
+def ler_parametros_img(nome):
+    """Valida ?w=&fmt=&q=(&sig=) e devolve (largura, formato, qualidade, negociado pelo Accept)"""
+    params = {k: v for k, v in request.args.items() if k != "sig"}
+    if IMG_SIGNING_KEY and not hmac.compare_digest(request.args.get("sig", ""), assinatura_img(nome, params)):
+        abort(403)
+    if set(params) - {"w", "fmt", "q"}:
+        abort(400)
+    if not params:
+        return None, None, None, False
+
+    try:
+        largura = int(params.get("w", max(VARIANTES.values())))
+        qualidade = int(params["q"]) if "q" in params else None
+    except ValueError:
+        abort(400)
+    # Larguras em degraus: limita quantas versões de cada imagem vão para o cache
+    largura = IMG_LARGURAS[min(bisect.bisect_left(IMG_LARGURAS, largura), len(IMG_LARGURAS) - 1)]
+
+    formato, negociado = params.get("fmt", "auto"), False
+    if formato == "auto":
+        negociado = True
+        aceitos = [f for f in ("avif", "webp") if f"image/{f}" in request.accept_mimetypes]
+        formato = next((f for f in aceitos if f in formatos_suportados()), "jpeg")
+    elif formato not in formatos_suportados():
+        abort(400)
+    # Qualidade também em degraus: /img é público e cada combinação nova custa um redimensionamento
+    if qualidade is None:
+        qualidade = QUALIDADE[formato]
+    else:
+        qualidade = min(IMG_QUALIDADES, key=lambda degrau: abs(degrau - qualidade))
+    return largura, formato, qualidade, negociado
+
+def caminho_cache_img(chave, ext):
+    """Arquivo do cache em disco para a chave (dois níveis de pasta pelo hash)"""
+    digest = hashlib.sha1(chave.encode()).hexdigest()
+    return os.path.join(IMG_CACHE_DIR, digest[:2], f"{digest}{ext}")
+
+def gravar_cache_img(caminho, escrever):
+    """Gera o arquivo com escrever(tmp), publica com rename atômico e aplica o limite do cache.
+    Devolve o arquivo já aberto: a limpeza do LRU pode apagar o nome, não o conteúdo em uso."""
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(caminho), prefix=".tmp_")
+    os.close(fd)
+    try:
+        escrever(tmp)
+        f = open(tmp, "rb")
+        os.replace(tmp, caminho)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    aplicar_limite_cache_img(os.fstat(f.fileno()).st_size)
+    return f
+
+def aplicar_limite_cache_img(novos_bytes):
+    """LRU por mtime: passando de IMG_CACHE_MB, apaga os menos usados até 90% do limite"""
+    limite = IMG_CACHE_MB * 1024 * 1024
+    with _img_cache_lock:
+        if _img_cache["total"] is not None:
+            _img_cache["total"] += novos_bytes
+            if _img_cache["total"] <= limite:
+                return
+        # Varre a pasta: a estimativa deste processo não vê o que os outros workers gravaram
+        arquivos = []
+        for pasta in glob.glob(os.path.join(IMG_CACHE_DIR, "??")):
+            for entrada in os.scandir(pasta):
+                if entrada.is_file() and not entrada.name.startswith(".tmp_"):
+                    info = entrada.stat()
+                    arquivos.append((info.st_mtime, info.st_size, entrada.path))
+        total = sum(tamanho for _, tamanho, _ in arquivos)
+        if total > limite:
+            for _, tamanho, caminho in sorted(arquivos):
+                try:
+                    os.remove(caminho)
+                except FileNotFoundError:
+                    pass
+                total -= tamanho
+                if total <= limite * 0.9:
+                    break
+            incrementar("galeria_img_cache_evictions_total", {})
+        _img_cache["total"] = total
+
+def abrir_cache_img(caminho, escrever):
+    """Abre o arquivo do cache ou, se ele não existe (ou acabou de sair pelo LRU), gera com escrever(tmp).
+    Renova o mtime (LRU) no máximo uma vez por hora."""
+    try:
+        f = open(caminho, "rb")
+    except FileNotFoundError:
+        incrementar("galeria_img_cache_total", {"resultado": "miss"})
+        return gravar_cache_img(caminho, escrever)
+    incrementar("galeria_img_cache_total", {"resultado": "hit"})
+    if time.time() - os.fstat(f.fileno()).st_mtime > 3600:
+        try:
+            os.utime(caminho)
+        except FileNotFoundError:
+            pass
+    return f
+
+def baixar_objeto(nome, f):
+    """Copia um objeto do bucket para o arquivo f, em blocos, com a chave do serviço
+    (funciona também em bucket privado); False se o objeto não existe"""
+    url = f"{SUPABASE_URL}/storage/v1/object/{BUCKET_NAME}/{nome}"
+    cabecalhos = {"authorization": f"Bearer {SUPABASE_KEY}", "apikey": SUPABASE_KEY}
+    with cliente_http().stream("GET", url, headers=cabecalhos) as r:
+        if r.status_code in (400, 404):
+            return False
+        r.raise_for_status()
+        for bloco in r.iter_bytes(TAMANHO_BLOCO):
+            f.write(bloco)
+    return True
+
+def baixar_original(nome, destino):
+    """Baixa o original do bucket para o arquivo destino; 404 se ele não existe"""
+    with open(destino, "wb") as f:
+        if not baixar_objeto(nome, f):
+            abort(404)
+
+def original_em_cache(nome):
+    """Original aberto a partir do cache em disco, baixando do storage se necessário"""
+    def baixar(tmp):
+        with etapa("storage_download"):
+            baixar_original(nome, tmp)
+    return abrir_cache_img(caminho_cache_img(nome, os.path.splitext(nome)[1]), baixar)
+
+def redimensionar_em_cache(nome, tmp, largura, formato, qualidade):
+    """Gera a versão redimensionada no pool; se o LRU apagar o original no meio, baixa de novo uma vez"""
+    for tentativa in range(2):
+        with original_em_cache(nome):
+            try:
+                with etapa("resize"):
+                    return pool_imagens().submit(redimensionar_imagem, caminho_cache_img(nome, os.path.splitext(nome)[1]),
+                                                 tmp, largura, formato, qualidade).result()
+            except FileNotFoundError:
+                if tentativa:
+                    raise
+
+def campos_variantes(variantes):
+    """Devolve a miniatura e um srcset pronto por formato a partir das variantes gravadas"""
+    variantes = variantes or {}
+    srcset = {}
+    for tamanho in VARIANTES:
+        item = variantes.get(tamanho)
+        if not item:
+            continue
+        for formato in FORMATOS_PIL:
+            if formato in item:
+                srcset.setdefault(formato, []).append(f"{item[formato]} {item['largura']}w")
+    miniatura = variantes.get("thumb", {})
+    return {
+        "thumb": miniatura.get("webp") or miniatura.get("jpeg"),
+        "srcset": {formato: ", ".join(urls) for formato, urls in srcset.items()},
+    }
+
+def campos_proxy(nome_arquivo):
+    """Mesmo formato do campos_variantes, com as versões servidas pelo /img (não depende da fila)"""
+    formatos = formatos_suportados()
+    return {
+        "thumb": url_proxy(nome_arquivo, w=VARIANTES["thumb"], fmt="webp"),
+        "srcset": {
+            formato: ", ".join(f"{url_proxy(nome_arquivo, w=lado, fmt=formato)} {lado}w" for lado in VARIANTES.values())
+            for formato in formatos
+        },
+    }
+
+def campos_imagem(linha):
+    """thumb/srcset da linha: pelo proxy quando IMG_PROXY=1, senão pelas variantes gravadas"""
+    return campos_proxy(linha['nome_arquivo']) if IMG_PROXY else campos_variantes(linha.get('variantes'))
+
+def item_galeria(linha):
+    """Formato de uma foto da galeria nas respostas da API (listagem e escritas)"""
+    return {"name": linha['nome_arquivo'], "url": url_original(linha), "tags": linha['tags'], **campos_imagem(linha)}
+
+def item_promocao(linha):
+    """Formato de uma promoção nas respostas da API (listagem e escritas)"""
+    return {**{c: linha.get(c) for c in COLUNAS_PROMOCOES.split(",")}, "url_imagem": url_original(linha), **campos_imagem(linha)}
+
+def codificar_cursor(linha):
+    """Gera o cursor opaco a partir da última linha da página"""
+    bruto = json.dumps([linha["created_at"], linha["nome_arquivo"]])
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor):
+    """Lê o cursor enviado pelo cliente e devolve (created_at, nome_arquivo)"""
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, nome = json.loads(bruto)
+        # Os dois valores vão entre aspas no filtro do PostgREST
+        if not all(isinstance(v, str) and '"' not in v and "\\" not in v for v in (created_at, nome)):
+            raise ValueError
+        datetime.fromisoformat(created_at)
+        return created_at, nome
+    except (ValueError, TypeError):
+        raise RequisicaoInvalida("Cursor inválido")
+
+def ler_limite():
+    """Lê o parâmetro ?limit= respeitando o teto configurado"""
+    try:
+        limite = int(request.args.get("limit", LIMITE_PADRAO))
+    except ValueError:
+        raise RequisicaoInvalida("Parâmetro limit inválido")
+    return max(1, min(limite, LIMITE_MAXIMO))
+
+def listar_pagina(tabela, colunas, filtrar=None):
+    """Consulta uma página ordenada por (created_at, nome_arquivo) e devolve (linhas, próximo cursor)"""
+    limite = ler_limite()
+    consulta = cliente_supabase().table(tabela).select(colunas) \
+        .order("created_at", desc=True).order("nome_arquivo", desc=True) \
+        .limit(limite + 1)
+    if filtrar:
+        consulta = filtrar(consulta)
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        created_at, nome = decodificar_cursor(cursor)
+        consulta = consulta.or_(
+            f'created_at.lt."{created_at}",'
+            f'and(created_at.eq."{created_at}",nome_arquivo.lt."{nome}")'
+        )
+
+    linhas = consulta.execute().data
+    proximo = codificar_cursor(linhas[limite - 1]) if len(linhas) > limite else None
+    return linhas[:limite], proximo
+
+def ler_filtros_tags():
+    """Lê ?tag= (repetível ou separado por vírgula), ?match=all|any e ?q= já normalizados"""
+    tags = [normalizar_tag(t) for valor in request.args.getlist("tag") for t in valor.split(",")]
+    tags = sorted({t for t in tags if t})
+    modo = request.args.get("match", "all")
+    if modo not in ("all", "any"):
+        raise RequisicaoInvalida("Parâmetro match deve ser 'all' ou 'any'")
+    return tags, modo, normalizar_tag(request.args.get("q", ""))
+
+def em_lotes(itens, tamanho):
+    """Fatia uma lista em pedaços de até tamanho itens"""
+    for inicio in range(0, len(itens), tamanho):
+        yield itens[inicio:inicio + tamanho]
+
+def ler_nomes_lote():
+    """Lê {"names": [...]} do corpo JSON das operações em lote (opcional)"""
+    corpo = request.get_json(silent=True) or {}
+    nomes = corpo.get("names") or []
+    if not isinstance(nomes, list) or not all(isinstance(n, str) and n for n in nomes):
+        raise RequisicaoInvalida("names deve ser uma lista de nomes de arquivo")
+    if len(nomes) > BULK_MAX:
+        raise RequisicaoInvalida(f"Máximo de {BULK_MAX} nomes por pedido")
+    return list(dict.fromkeys(nomes))
+
+def ler_lista_tags(valor):
+    """Aceita "a, b" ou ["a", "b"] e devolve a lista sem itens vazios"""
+    if isinstance(valor, str):
+        valor = valor.split(",")
+    if not isinstance(valor, list):
+        raise RequisicaoInvalida("add/remove devem ser texto separado por vírgulas ou lista")
+    return [t.strip() for t in valor if isinstance(t, str) and t.strip()]
+
+def apagar_em_lote(tabela, nomes, filtrar):
+    """DELETE com in.() (em fatias que cabem na URL) e/ou filtro; devolve os nomes apagados"""
+    tabela = cliente_supabase().table(tabela)
+    if nomes:
+        consultas = (filtrar(tabela.delete().in_("nome_arquivo", lote)) for lote in em_lotes(nomes, BULK_IN_LOTE))
+    else:
+        consultas = [filtrar(tabela.delete())]
+    removidos = [linha["nome_arquivo"] for consulta in consultas for linha in consulta.execute().data]
+    if removidos:
+        invalidar_cache()
+        agendar_remocoes(removidos)
+    return removidos
+
+def filtrar_tags(tags, modo, q):
+    """Monta o filtro PostgREST: @> (todas as tags) ou && (qualquer uma) e busca parcial no texto"""
+    def aplicar(consulta):
+        if tags:
+            consulta = consulta.contains("tags_norm", tags) if modo == "all" else consulta.overlaps("tags_norm", tags)
+        if q:
+            consulta = consulta.ilike("tags_busca", f"%{q}%")
+        return consulta
+    return aplicar
+
+def resposta_paginada(itens, proximo):
+    """Mantém o corpo como lista e envia o próximo cursor nos cabeçalhos"""
+    with etapa("json"):
+        resposta = jsonify(itens)
+    if proximo:
+        resposta.headers["X-Next-Cursor"] = proximo
+        # Mantém todos os parâmetros (tag, match, q, limit...) e troca só o cursor
+        args = request.args.to_dict(flat=False)
+        args.update(cursor=[proximo], limit=[str(ler_limite())])
+        resposta.headers["Link"] = f'<{url_for(request.endpoint, **request.view_args, **args)}>; rel="next"'
+    return resposta
+
+def geracao_atual():
+    """Lê o contador de escritas compartilhado por todos os workers"""
+    try:
+        with open(ARQUIVO_GERACAO, "rb") as f:
+            return int(f.read() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def invalidar_cache():
+    """Incrementa a geração compartilhada para que todos os workers descartem suas listagens"""
+    fd = os.open(ARQUIVO_GERACAO, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            atual = int(os.pread(fd, 32, 0) or 0)
+        except ValueError:
+            atual = 0
+        # Largura fixa: o leitor nunca vê o arquivo truncado pela metade
+        os.pwrite(fd, f"{atual + 1:020d}".encode(), 0)
+    finally:
+        os.close(fd)
+    with _cache_lock:
+        _cache_listagens.clear()
+
+def cache_listagem(view):
+    """Guarda a resposta da listagem por TTL/geração e responde 304 quando o ETag bate"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        chave = request.full_path
+        if IMG_PROXY and not IMG_BASE_URL:
+            # As URLs do /img saem do host do request: cada host tem a sua cópia
+            chave = f"{request.host_url}|{chave}"
+        geracao = geracao_atual()
+        agora = time.monotonic()
+
+        with _cache_lock:
+            entrada = _cache_listagens.get(chave)
+        if not entrada or entrada["geracao"] != geracao or entrada["expira"] < agora:
+            resposta = view(*args, **kwargs)
+            if resposta.status_code != 200:
+                return resposta
+            entrada = {
+                "geracao": geracao,
+                "expira": agora + CACHE_TTL,
+                "corpo": resposta.get_data(),
+                "cabecalhos": {k: v for k, v in resposta.headers.items() if k in ("X-Next-Cursor", "Link")},
+            }
+            entrada["etag"] = hashlib.sha1(entrada["corpo"]).hexdigest()
+            with _cache_lock:
+                _cache_listagens.pop(chave, None)
+                _cache_listagens[chave] = entrada
+                while len(_cache_listagens) > CACHE_MAX_ENTRADAS:
+                    _cache_listagens.pop(next(iter(_cache_listagens)))
+
+        resposta = Response(entrada["corpo"], mimetype="application/json", headers=entrada["cabecalhos"])
+        resposta.set_etag(entrada["etag"])
+        # Privada para todo escopo: com Vary: Authorization cada token teria a sua cópia no proxy,
+        # e sem o Vary um proxy entregaria a listagem a quem não tem token. O ETag poupa o corpo.
+        resposta.headers["Cache-Control"] = "private, no-cache"
+        return resposta.make_conditional(request)
+    return wrapper
+
+# --- FEED DE ALTERAÇÕES (/api/changes) ---
+
+def fontes_feed():
+    """Tabelas publicadas no feed: nome na API -> (tabela, colunas, formatação do item)"""
+    return {
+        "images": ("galeria_tags_jundiai", COLUNAS_GALERIA + ",updated_at", item_galeria),
+        "promotions": ("promocoes_ativas_jundiai", COLUNAS_PROMOCOES + ",updated_at", item_promocao),
+    }
+
+def codificar_token(posicoes):
+    """Token opaco com a posição lida em cada fonte (tabelas e registro de remoções) e a hora da leitura (t)"""
+    bruto = json.dumps(posicoes, separators=(",", ":"))
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip("=")
+
+def decodificar_token(token):
+    """Lê o token ?since= (ou Last-Event-ID); vazio começa do zero, com todas as linhas atuais.
+    TokenExpirado se as lápides seguintes já podem ter sido apagadas."""
+    if not token:
+        return {}
+    try:
+        posicoes = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        if not isinstance(posicoes, dict):
+            raise ValueError
+        for fonte, posicao in posicoes.items():
+            if fonte == "t":
+                if type(posicao) is not int:
+                    raise ValueError
+            elif fonte != "removidos" and fonte not in fontes_feed():
+                raise ValueError
+            # [carimbo, nome_arquivo] ou [removido_em, id]: o texto vai entre aspas no filtro do PostgREST
+            elif not (isinstance(posicao, list) and len(posicao) == 2 and isinstance(posicao[0], str)
+                      and (type(posicao[1]) is int if fonte == "removidos" else isinstance(posicao[1], str))
+                      and not any(isinstance(v, str) and ('"' in v or "\\" in v) for v in posicao)):
+                raise ValueError
+            else:
+                datetime.fromisoformat(posicao[0])
+    except ValueError:
+        raise RequisicaoInvalida("Token since inválido")
+    if posicoes.get("t", time.time()) < time.time() - CHANGES_RETENCAO:
+        raise TokenExpirado()
+    return posicoes
+
+def buscar_alteracoes(posicoes, limite):
+    """Devolve (alterações em ordem de tempo, novas posições, se ainda há mais).
+    Só lê o que foi gravado antes de agora - CHANGES_SETTLE: o token nunca passa de uma
+    transação que ainda pode fazer commit com um carimbo anterior."""
+    assentado = (datetime.now(timezone.utc) - timedelta(seconds=CHANGES_SETTLE)).isoformat(timespec="microseconds")
+    candidatos, cortes = [], []
+    for fonte, (tabela, colunas, formatar) in fontes_feed().items():
+        consulta = cliente_supabase().table(tabela).select(colunas).lt("updated_at", assentado) \
+            .order("updated_at,nome_arquivo").limit(limite)
+        if posicoes.get(fonte):
+            updated_at, nome = posicoes[fonte]
+            consulta = consulta.or_(
+                f'updated_at.gt."{updated_at}",'
+                f'and(updated_at.eq."{updated_at}",nome_arquivo.gt."{nome}")'
+            )
+        linhas = consulta.execute().data
+        if len(linhas) == limite:
+            cortes.append(linhas[-1]["updated_at"])
+        candidatos += [
+            (l["updated_at"], fonte, [l["updated_at"], l["nome_arquivo"]],
+             {"op": "upsert", "table": fonte, "at": l["updated_at"], "item": formatar(l)})
+            for l in linhas
+        ]
+
+    # Lápides pela mesma chave (instante, desempate): a ordem do id também é a do início, não a do commit
+    consulta = cliente_supabase().table("registro_remocoes").select("id,tabela,nome_arquivo,removido_em") \
+        .lt("removido_em", assentado).order("removido_em,id").limit(limite)
+    if posicoes.get("removidos"):
+        removido_em, lapide_id = posicoes["removidos"]
+        consulta = consulta.or_(
+            f'removido_em.gt."{removido_em}",'
+            f'and(removido_em.eq."{removido_em}",id.gt.{lapide_id})'
+        )
+    lapides = consulta.execute().data
+    if len(lapides) == limite:
+        cortes.append(lapides[-1]["removido_em"])
+    nomes_api = {tabela: fonte for fonte, (tabela, _, _) in fontes_feed().items()}
+    candidatos += [
+        (l["removido_em"], "removidos", [l["removido_em"], l["id"]],
+         {"op": "delete", "table": nomes_api.get(l["tabela"], l["tabela"]), "at": l["removido_em"], "name": l["nome_arquivo"]})
+        for l in lapides
+    ]
+
+    # Uma fonte que encheu a página pode ter mais linhas antes das das outras:
+    # corta tudo no menor instante entre as fontes cheias para manter a ordem global.
+    # (Os carimbos vêm todos em UTC, então a comparação de texto segue a ordem de tempo.)
+    corte = min(cortes) if cortes else None
+    alteracoes, novas = [], {**posicoes, "t": int(time.time())}
+    for instante, fonte, posicao, alteracao in sorted(candidatos, key=lambda c: c[0]):
+        if corte is not None and instante > corte:
+            break
+        alteracoes.append(alteracao)
+        novas[fonte] = posicao
+    return alteracoes, novas, bool(cortes)
+
+def esperar_escrita(geracao, segundos):
+    """Aguarda até a geração compartilhada mudar (alguma escrita neste servidor) ou o tempo acabar.
+    Depois de uma escrita espera também CHANGES_SETTLE, para ela já entrar na próxima leitura do feed."""
+    limite = time.monotonic() + segundos
+    while time.monotonic() < limite:
+        if geracao_atual() != geracao:
+            time.sleep(CHANGES_SETTLE)
+            return True
+        time.sleep(CHANGES_INTERVALO)
+    return False
+
+def eventos_alteracoes(posicoes, limite):
+    """Gerador do modo Server-Sent Events: um evento por lote, com o token como id"""
+    yield f"retry: {int(CHANGES_HEARTBEAT * 1000)}\n\n"
+    while True:
+        geracao = geracao_atual()
+        alteracoes, posicoes, ha_mais = buscar_alteracoes(posicoes, limite)
+        if alteracoes:
+            dados = json.dumps({"changes": alteracoes, "has_more": ha_mais})
+            yield f"id: {codificar_token(posicoes)}\nevent: changes\ndata: {dados}\n\n"
+        if ha_mais:
+            continue
+        if not esperar_escrita(geracao, CHANGES_HEARTBEAT):
+            # Comentário SSE: mantém a conexão viva atrás de proxies
+            yield ": ping\n\n"
+
+def enviar_pre_comprimido(caminho, mimetype, max_age):
+    """Envia a versão .br/.gz gerada no build quando o cliente aceita, com ETag e 304"""
+    codificacao = None
+    for nome, ext in (("br", ".br"), ("gzip", ".gz")):
+        if nome in request.accept_encodings and os.path.isfile(caminho + ext):
+            codificacao, arquivo = nome, caminho + ext
+            break
+    else:
+        arquivo = caminho
+
+    resposta = send_file(
+        arquivo,
+        mimetype=mimetype or mimetypes.guess_type(caminho)[0],
+        max_age=max_age,
+        conditional=True,
+    )
+    if codificacao:
+        resposta.headers["Content-Encoding"] = codificacao
+    resposta.vary.add("Accept-Encoding")
+    return resposta
+
+@app.before_request
+def iniciar_medicao():
+    g.inicio_request = time.perf_counter()
+
+@app.after_request
+def registrar_medicao(resposta):
+    """Histograma por rota e cabeçalho Server-Timing com o tempo gasto em cada serviço"""
+    total = time.perf_counter() - g.get("inicio_request", time.perf_counter())
+    rota = request.url_rule.rule if request.url_rule else "desconhecida"
+    observar("galeria_http_request_seconds", {"rota": rota, "metodo": request.method, "status": resposta.status_code}, total)
+    tempos = g.get("server_timing", {})
+    resposta.headers["Server-Timing"] = ", ".join(
+        [f"{nome};dur={segundos * 1000:.1f}" for nome, segundos in tempos.items()] + [f"total;dur={total * 1000:.1f}"]
     )
-    url = supabase.storage.from_(BUCKET_NAME).get_public_url(nome_final)
-    return nome_final, url
+    gravar_metricas()
+    return resposta
+
+@app.route("/metrics")
+def metrics():
+    """Métricas de todos os workers no formato do Prometheus (fora do /api: sem senha)"""
+    gravar_metricas(forcar=True)
+    return Response(texto_prometheus(), mimetype="text/plain; version=0.0.4")
+
+@app.before_request
+def garantir_fila():
+    """Workers que nunca enfileiraram nada também drenam tarefas pendentes"""
+    iniciar_fila()
+
+def b64url(dados):
+    return base64.urlsafe_b64encode(dados).decode().rstrip("=")
+
+def assinar(corpo):
+    return b64url(hmac.new(SESSION_SECRET.encode(), corpo.encode(), hashlib.sha256).digest())
+
+def emitir_token(escopo, ttl):
+    """Token "<conteúdo>.<hmac>" com escopo e validade; devolve (token, expira_em)"""
+    agora = int(time.time())
+    corpo = b64url(json.dumps({"s": escopo, "iat": agora, "exp": agora + ttl}, separators=(",", ":")).encode())
+    return f"{corpo}.{assinar(corpo)}", agora + ttl
+
+@lru_cache(maxsize=1024)
+def ler_token(token):
+    """(escopo, emitido_em, expira_em) de um token bem assinado, ou None.
+    Cacheado: os bots repetem o mesmo token e não precisam refazer HMAC/JSON a cada request."""
+    corpo, _, assinatura = token.partition(".")
+    if not hmac.compare_digest(assinatura.encode(), assinar(corpo).encode()):
+        return None
+    try:
+        dados = json.loads(base64.urlsafe_b64decode(corpo + "=" * (-len(corpo) % 4)))
+        return dados["s"], dados["iat"], dados["exp"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def senha_confere(senha):
+    """Compara com APP_PASSWORD em tempo constante"""
+    return bool(APP_PASSWORD) and hmac.compare_digest((senha or "").encode(), APP_PASSWORD.encode())
+
+def sessao_request():
+    """Sessão do request: Bearer token válido ou, por compatibilidade, o cabeçalho x-app-password (admin)"""
+    autorizacao = request.headers.get("Authorization", "")
+    if autorizacao.startswith("Bearer "):
+        sessao = ler_token(autorizacao[len("Bearer "):].strip())
+        return sessao if sessao and sessao[2] > time.time() else None
+    if "x-app-password" in request.headers and senha_confere(request.headers["x-app-password"]):
+        return ("admin", None, None)
+    return None
 
 @app.before_request
 def check_auth():
-    """Validação de senha para todas as rotas da API"""
+    """Autenticação de todas as rotas da API (menos o login); tokens read só fazem GET"""
+    if not request.path.startswith("/api") or request.path == "/api/login":
+        return
+    g.sessao = sessao_request()
+    if g.sessao is None:
+        return jsonify({"error": "Acesso não autorizado"}), 401
+    if g.sessao[0] == "read" and (request.method not in ("GET", "HEAD") or request.path == "/api/tokens"):
+        return jsonify({"error": "Token somente leitura"}), 403
+
+@app.after_request
+def cabecalhos_sessao(resposta):
+    """Vary pelas credenciais em toda a API e renovação da sessão do painel depois de meia validade"""
     if request.path.startswith("/api"):
-        password = request.headers.get("x-app-password")
-        if password != APP_PASSWORD:
-            return jsonify({"error": "Acesso não autorizado"}), 401
+        resposta.vary.add("Authorization")
+        resposta.vary.add("x-app-password")
+        sessao = g.get("sessao")
+        if sessao and sessao[0] == "admin" and sessao[1] and time.time() - sessao[1] > SESSION_TTL / 2:
+            resposta.headers["X-Session-Token"] = emitir_token("admin", SESSION_TTL)[0]
+    return resposta
+
+@app.before_request
+def medir_multipart():
+    """Força o parse do multipart aqui (depois da senha) para medir o tempo do Werkzeug"""
+    if request.mimetype == "multipart/form-data":
+        with etapa("multipart"):
+            request.files
 
 @app.route("/")
 def index():
-    return render_template_string("""
-<!DOCTYPE html>
-<html lang="pt-br">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Serena Admin | Painel de Controle</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <script src="https://unpkg.com/lucide@latest"></script>
-    <style>
-        @import url('https://fonts.googleapis.com/css2?family=Plus+Jakarta+Sans:wght@400;600;700;800&display=swap');
-        
-        body { 
-            font-family: 'Plus Jakarta Sans', sans-serif; 
-            background: #f8fafc; 
-            color: #1e293b;
-        }
+    """Painel: HTML estático já pronto (gerado pelo build_assets.py), sem renderização por request"""
+    caminho = os.path.join(DIST_DIR, "index.html")
+    if not os.path.exists(caminho):
+        # Sem build: serve a fonte, que ainda usa o Tailwind/lucide da CDN
+        caminho = PAGINA_FONTE
+    resposta = enviar_pre_comprimido(caminho, "text/html", max_age=0)
+    resposta.cache_control.no_cache = True
+    return resposta
 
-        .tab-btn {
-            padding: 12px 24px;
-            border-radius: 16px;
-            font-weight: 700;
-            transition: all 0.3s ease;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-            color: #64748b;
-        }
+@app.route("/assets/<path:nome>")
+def assets(nome):
+    """CSS/JS com hash no nome: podem ficar em cache para sempre"""
+    caminho = safe_join(DIST_DIR, nome)
+    if caminho is None or not os.path.isfile(caminho):
+        abort(404)
+    resposta = enviar_pre_comprimido(caminho, None, max_age=ASSETS_MAX_AGE)
+    resposta.cache_control.public = True
+    resposta.cache_control.immutable = True
+    return resposta
 
-        .tab-btn.active-galeria { background: #4f46e5; color: white; box-shadow: 0 10px 15px -3px rgba(79, 70, 229, 0.3); }
-        .tab-btn.active-promo { background: #f97316; color: white; box-shadow: 0 10px 15px -3px rgba(249, 115, 22, 0.3); }
+@app.route("/img/<nome>")
+def imagem(nome):
+    """Original ou versão redimensionada (?w=&fmt=auto|avif|webp|jpeg&q=) de um arquivo do bucket.
+    O nome é o hash do conteúdo, então cada URL é imutável: ETag forte, cache de um ano e Range."""
+    if not re.fullmatch(r"[A-Za-z0-9][A-Za-z0-9._-]*", nome):
+        abort(404)
+    largura, formato, qualidade, negociado = ler_parametros_img(nome)
+    etag = hashlib.sha1(f"{nome}|{largura}|{formato}|{qualidade}".encode()).hexdigest()
 
-        .glass-card {
-            background: white;
-            border: 1px solid #e2e8f0;
-            border-radius: 28px;
-            transition: all 0.4s cubic-bezier(0.175, 0.885, 0.32, 1.275);
-        }
+    if request.if_none_match.contains(etag):
+        # 304 sem tocar no disco: o conteúdo de uma URL nunca muda
+        resposta = Response(status=304)
+    else:
+        # Um único open: o send_file serve o arquivo aberto mesmo que o LRU apague o nome em seguida
+        if formato is None:
+            arquivo, mimetype = original_em_cache(nome), mimetypes.guess_type(nome)[0] or "application/octet-stream"
+        else:
+            arquivo = abrir_cache_img(caminho_cache_img(f"{nome}|{largura}|{qualidade}", f".{formato}"),
+                                      lambda tmp: redimensionar_em_cache(nome, tmp, largura, formato, qualidade))
+            mimetype = f"image/{formato}"
+        info = os.fstat(arquivo.fileno())
+        # Com um arquivo aberto o send_file não sabe o tamanho: Content-Length e Range ficam por nossa conta
+        resposta = send_file(arquivo, mimetype=mimetype, conditional=False, etag=etag, max_age=IMG_MAX_AGE,
+                             last_modified=info.st_mtime)
+        resposta.content_length = info.st_size
+        resposta.make_conditional(request, accept_ranges=True, complete_length=info.st_size)
 
-        .glass-card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 20px 25px -5px rgba(0, 0, 0, 0.05);
-        }
+    resposta.set_etag(etag)
+    resposta.cache_control.public = True
+    resposta.cache_control.max_age = IMG_MAX_AGE
+    resposta.cache_control.immutable = True
+    if negociado:
+        resposta.vary.add("Accept")
+    return resposta
 
-        .modal-blur {
-            backdrop-filter: blur(12px);
-            background: rgba(15, 23, 42, 0.6);
-        }
+# --- ROTAS DA API NO BACKEND (PYTHON) ---
 
-        input, textarea {
-            border: 2px solid #f1f5f9 !important;
-            transition: all 0.2s ease;
-        }
+def resposta_token(escopo, ttl):
+    """Token assinado: admin dura SESSION_TTL; read aceita ttl até READ_TOKEN_TTL_MAX"""
+    try:
+        ttl = min(int(ttl), READ_TOKEN_TTL_MAX) if escopo == "read" and ttl else SESSION_TTL
+    except (TypeError, ValueError):
+        raise RequisicaoInvalida("ttl inválido")
+    token, expira = emitir_token(escopo, max(ttl, 60))
+    resposta = jsonify({"token": token, "scope": escopo, "expires_at": expira})
+    resposta.headers["Cache-Control"] = "no-store"
+    return resposta
 
-        input:focus, textarea:focus {
-            border-color: #e2e8f0 !important;
-            box-shadow: 0 0 0 4px rgba(79, 70, 229, 0.1) !important;
-            background: white !important;
-        }
-    </style>
-</head>
-<body class="min-h-screen pb-20">
-
-    <div id="toast" class="fixed top-6 left-1/2 -translate-x-1/2 z-[200] px-6 py-3 rounded-full font-bold shadow-2xl opacity-0 transition-all pointer-events-none text-sm"></div>
-
-    <div id="loginPage" class="fixed inset-0 flex flex-col items-center justify-center bg-white z-[150]">
-        <div class="w-full max-w-sm px-8 text-center">
-            <div class="w-20 h-20 bg-indigo-600 rounded-[2rem] flex items-center justify-center shadow-xl mx-auto mb-6 rotate-3">
-                <i data-lucide="shield-check" class="text-white w-10 h-10 -rotate-3"></i>
-            </div>
-            <h1 class="text-3xl font-extrabold text-slate-900 mb-2">Painel Serena</h1>
-            <p class="text-slate-400 mb-8 font-medium">Controle de Conteúdo Jundiaí</p>
-            <input type="password" id="pwdInput" class="w-full p-5 bg-slate-50 border-none rounded-2xl text-center text-2xl font-bold outline-none mb-4" placeholder="••••">
-            <button onclick="handleLogin()" class="w-full bg-slate-900 text-white p-5 rounded-2xl font-bold hover:bg-black transition-all">Acessar Sistema</button>
-        </div>
-    </div>
-
-    <div id="mainPage" class="hidden">
-        <header class="fixed top-0 left-0 right-0 z-40 p-4">
-            <div class="max-w-5xl mx-auto flex items-center justify-between bg-white/80 backdrop-blur-xl border border-white/40 p-3 rounded-[2rem] shadow-lg">
-                <div class="flex items-center gap-3 pl-4">
-                    <div class="w-10 h-10 bg-indigo-600 rounded-xl flex items-center justify-center text-white">
-                        <i data-lucide="zap" class="w-5 h-5"></i>
-                    </div>
-                    <span class="font-extrabold text-lg hidden md:block">Serena Admin</span>
-                </div>
-
-                <nav class="flex gap-2 bg-slate-100/50 p-1.5 rounded-2xl">
-                    <button onclick="switchTab('galeria')" id="btn-galeria" class="tab-btn active-galeria">
-                        <i data-lucide="image"></i> Galeria
-                    </button>
-                    <button onclick="switchTab('promocoes')" id="btn-promocoes" class="tab-btn">
-                        <i data-lucide="flame"></i> Promos
-                    </button>
-                </nav>
-
-                <button onclick="logout()" class="w-12 h-12 flex items-center justify-center text-slate-400 hover:text-red-500 transition-colors">
-                    <i data-lucide="log-out"></i>
-                </button>
-            </div>
-        </header>
-
-        <main class="max-w-5xl mx-auto px-6 mt-32">
-            
-            <div id="tab-galeria" class="space-y-8">
-                <section class="bg-white rounded-[2.5rem] p-8 border border-slate-100 shadow-sm">
-                    <h3 class="text-xl font-extrabold mb-6 flex items-center gap-2"><i data-lucide="plus-circle" class="text-indigo-600"></i> Adicionar à Galeria</h3>
-                    <div class="grid grid-cols-1 md:grid-cols-2 gap-4">
-                        <div class="relative">
-                            <input type="file" id="fileGaleria" class="w-full p-4 bg-slate-50 rounded-2xl text-sm border-2 border-dashed border-slate-200">
-                        </div>
-                        <input type="text" id="tagsGaleria" placeholder="Tags (ex: Unhas, Noivas, Preços)" class="w-full p-4 bg-slate-50 rounded-2xl outline-none font-semibold">
-                    </div>
-                    <button onclick="uploadGaleria()" id="btnUpGal" class="w-full mt-6 bg-indigo-600 text-white py-5 rounded-2xl font-extrabold hover:bg-indigo-700 shadow-lg shadow-indigo-100 transition-all flex items-center justify-center gap-2">
-                        <i data-lucide="upload-cloud"></i> Publicar Foto
-                    </button>
-                </section>
-                <div id="list-galeria" class="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 gap-6"></div>
-            </div>
-
-            <div id="tab-promocoes" class="hidden space-y-8">
-                <section class="bg-white rounded-[2.5rem] p-8 border border-slate-100 shadow-sm">
-                    <h3 class="text-xl font-extrabold mb-6 flex items-center gap-2"><i data-lucide="megaphone" class="text-orange-500"></i> Nova Promoção Ativa</h3>
-                    <div class="space-y-4">
-                        <input type="file" id="filePromo" class="w-full p-4 bg-slate-50 rounded-2xl text-sm border-2 border-dashed">
-                        <input type="text" id="tituloPromo" placeholder="Título da Campanha" class="w-full p-4 bg-slate-50 rounded-2xl font-bold outline-none">
-                        <textarea id="textoPromo" placeholder="Descrição da oferta para a Serena falar..." class="w-full p-4 bg-slate-50 rounded-2xl h-32 outline-none font-medium"></textarea>
-                        <input type="text" id="tagPromo" placeholder="Tag única (ex: promo_natal)" class="w-full p-4 bg-slate-50 rounded-2xl outline-none">
-                    </div>
-                    <button onclick="uploadPromo()" id="btnUpPromo" class="w-full mt-6 bg-orange-500 text-white py-5 rounded-2xl font-extrabold hover:bg-orange-600 shadow-lg shadow-orange-100 transition-all">
-                        Ativar Campanha Agora
-                    </button>
-                </section>
-                <div id="list-promocoes" class="grid grid-cols-1 gap-6"></div>
-            </div>
-        </main>
-    </div>
-
-    <div id="editModal" class="fixed inset-0 z-[200] hidden flex items-center justify-center p-4 modal-blur">
-        <div class="bg-white max-w-lg w-full rounded-[3rem] p-10 shadow-2xl overflow-y-auto max-h-[90vh]">
-            <div class="flex justify-between items-center mb-8">
-                <h3 class="text-2xl font-black flex items-center gap-3"><i data-lucide="edit-3" class="text-indigo-600"></i> Ajustar Dados</h3>
-                <button onclick="closeModal('editModal')" class="bg-slate-100 p-2 rounded-full text-slate-500 hover:bg-red-50 hover:text-red-500 transition-all"><i data-lucide="x"></i></button>
-            </div>
-            
-            <div class="mb-6 group relative">
-                <p class="text-[10px] font-black text-slate-400 uppercase tracking-widest mb-2">Imagem Atual</p>
-                <img id="imgCurrent" src="" class="w-full h-56 object-cover rounded-[2rem] border-4 border-slate-50 shadow-inner">
-            </div>
-
-            <div class="space-y-6">
-                <div class="bg-indigo-50/50 p-6 rounded-3xl border border-indigo-100">
-                    <label class="text-xs font-black text-indigo-600 uppercase mb-2 block">Deseja trocar a imagem?</label>
-                    <input type="file" id="editFile" class="w-full text-sm text-slate-500 file:mr-4 file:py-2 file:px-4 file:rounded-full file:border-0 file:text-xs file:font-bold file:bg-indigo-600 file:text-white hover:file:bg-indigo-700">
-                </div>
-
-                <div id="editFormFields" class="space-y-4"></div>
-            </div>
-
-            <div class="flex gap-4 mt-10">
-                <button onclick="closeModal('editModal')" class="flex-1 py-4 bg-slate-100 rounded-2xl font-bold text-slate-500 hover:bg-slate-200 transition">Voltar</button>
-                <button id="saveEditBtn" class="flex-1 py-4 bg-slate-900 text-white rounded-2xl font-bold shadow-xl hover:scale-[1.02] active:scale-[0.98] transition-all">Salvar Alterações</button>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        const getAuth = () => localStorage.getItem('planeta_auth');
-
-        function notify(msg, type='success') {
-            const t = document.getElementById('toast');
-            t.innerText = msg;
-            t.className = `fixed top-6 left-1/2 -translate-x-1/2 z-[200] px-6 py-3 rounded-full font-bold shadow-2xl opacity-100 transition-all ${type==='success'?'bg-slate-900 text-white':'bg-red-500 text-white'}`;
-            setTimeout(() => t.style.opacity = '0', 3000);
-        }
+@app.route("/api/login", methods=["POST"])
+def login():
+    """Troca a senha por um token de sessão: {"password", "scope": "admin"|"read", "ttl"}"""
+    corpo = request.get_json(silent=True) or request.form
+    if not senha_confere(corpo.get("password")):
+        return jsonify({"error": "Senha inválida"}), 401
+    escopo = corpo.get("scope", "admin")
+    if escopo not in ESCOPOS:
+        raise RequisicaoInvalida("scope deve ser 'admin' ou 'read'")
+    return resposta_token(escopo, corpo.get("ttl"))
 
-        function closeModal(id) { document.getElementById(id).classList.add('hidden'); }
+@app.route("/api/tokens", methods=["POST"])
+def create_token():
+    """Emite um token read para um bot sem expor a senha (só com sessão admin): {"ttl": segundos}"""
+    corpo = request.get_json(silent=True) or {}
+    return resposta_token("read", corpo.get("ttl"))
 
-        async function handleLogin() {
-            const pwd = document.getElementById('pwdInput').value;
-            const res = await fetch('/api/images', { headers: {'x-app-password': pwd} });
-            if (res.ok) { localStorage.setItem('planeta_auth', pwd); location.reload(); }
-            else { notify("Senha inválida", "error"); }
-        }
+@app.route("/api/uploads", methods=["POST"])
+def create_upload():
+    """Abre uma sessão de upload em partes: {"filename", "content_type", "size"} -> id e tamanho das partes.
+    Depois: PUT /api/uploads/<id>/parts/<n> em qualquer ordem e o upload_id no formulário de sempre,
+    que responde 202 e grava em segundo plano (acompanhe por GET /api/uploads/<id>)."""
+    corpo = request.get_json(silent=True) or {}
+    try:
+        tamanho = int(corpo.get("size", 0))
+    except (TypeError, ValueError):
+        raise RequisicaoInvalida("size inválido")
+    if tamanho <= 0:
+        raise RequisicaoInvalida("size inválido")
+    if tamanho > app.config["MAX_CONTENT_LENGTH"]:
+        raise RequestEntityTooLarge()
 
-        function switchTab(tab) {
-            const isGal = tab === 'galeria';
-            document.getElementById('tab-galeria').classList.toggle('hidden', !isGal);
-            document.getElementById('tab-promocoes').classList.toggle('hidden', isGal);
-            
-            document.getElementById('btn-galeria').className = `tab-btn ${isGal ? 'active-galeria' : ''}`;
-            document.getElementById('btn-promocoes').className = `tab-btn ${!isGal ? 'active-promo' : ''}`;
-            
-            isGal ? loadGaleria() : loadPromos();
-        }
+    # Sessões abandonadas de qualquer dyno são apagadas em segundo plano
+    enfileirar("limpar_sessoes_upload", chave="limpar_sessoes_upload")
+    upload_id = f"{int(time.time()):08x}-{secrets.token_urlsafe(18)}"
+    meta = {
+        "filename": str(corpo.get("filename") or ""),
+        "content_type": str(corpo.get("content_type") or "application/octet-stream"),
+        "size": tamanho,
+        "part_size": TAMANHO_PARTE_UPLOAD,
+        "parts": -(-tamanho // TAMANHO_PARTE_UPLOAD),
+        "status": "recebendo",
+    }
+    gravar_sessao_upload(upload_id, meta)
+    resposta = jsonify({"id": upload_id, **meta, "parts_done": []})
+    resposta.status_code = 201
+    resposta.headers["Location"] = f"/api/uploads/{upload_id}"
+    return resposta
 
-        async function loadGaleria() {
-            const res = await fetch('/api/images', { headers: {'x-app-password': getAuth()} });
-            const data = await res.json();
-            document.getElementById('list-galeria').innerHTML = data.map(img => `
-                <div class="glass-card group overflow-hidden p-3">
-                    <img src="${img.url}" class="w-full h-64 object-cover rounded-[1.5rem] mb-4">
-                    <div class="px-2 pb-2">
-                        <div class="flex flex-wrap gap-2 mb-4">
-                            ${img.tags.split(',').map(t => `<span class="bg-slate-100 text-slate-500 text-[9px] px-2 py-1 rounded-lg font-black uppercase">#${t.trim()}</span>`).join('')}
-                        </div>
-                        <div class="flex gap-2">
-                            <button onclick='openEditGaleria(${JSON.stringify(img)})' class="flex-1 py-3 bg-indigo-50 text-indigo-600 rounded-xl font-bold text-xs hover:bg-indigo-600 hover:text-white transition-all">Editar Dados</button>
-                            <button onclick="deleteItem('images', '${img.name}')" class="p-3 bg-red-50 text-red-500 rounded-xl hover:bg-red-500 hover:text-white transition-all"><i data-lucide="trash-2" class="w-4 h-4"></i></button>
-                        </div>
-                    </div>
-                </div>
-            `).join('');
-            lucide.createIcons();
-        }
+@app.route("/api/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    """Partes já recebidas, para retomar depois de uma queda de conexão, e o estado da finalização:
+    recebendo, processando, ok (com o item), duplicada, nao_encontrado ou erro"""
+    meta = ler_sessao_upload(upload_id)
+    meta.setdefault("status", "recebendo")
+    partes = partes_recebidas(upload_id) if meta["status"] in ("recebendo", "erro") else []
+    resposta = jsonify({"id": upload_id, **meta, "parts_done": partes})
+    resposta.headers["Cache-Control"] = "no-store"
+    return resposta
 
-        async function loadPromos() {
-            const res = await fetch('/api/promotions', { headers: {'x-app-password': getAuth()} });
-            const data = await res.json();
-            document.getElementById('list-promocoes').innerHTML = data.map(p => `
-                <div class="glass-card p-5 flex flex-col md:flex-row items-center gap-6">
-                    <img src="${p.url_imagem}" class="w-full md:w-32 h-32 object-cover rounded-2xl shadow-md">
-                    <div class="flex-1 text-center md:text-left">
-                        <span class="text-[9px] bg-orange-100 text-orange-600 px-3 py-1 rounded-full font-black uppercase tracking-widest">#${p.tag}</span>
-                        <h4 class="text-lg font-extrabold mt-2 mb-1">${p.titulo}</h4>
-                        <p class="text-slate-400 text-sm line-clamp-2">${p.texto_informativo}</p>
-                    </div>
-                    <div class="flex md:flex-col gap-2 w-full md:w-auto">
-                        <button onclick='openEditPromo(${JSON.stringify(p)})' class="flex-1 md:flex-none p-4 bg-slate-900 text-white rounded-2xl font-bold text-xs hover:bg-black transition-all">Ajustar</button>
-                        <button onclick="deleteItem('promotions', '${p.nome_arquivo}')" class="p-4 bg-red-50 text-red-500 rounded-2xl hover:bg-red-500 hover:text-white transition-all"><i data-lucide="trash-2" class="w-5 h-5"></i></button>
-                    </div>
-                </div>
-            `).join('');
-            lucide.createIcons();
-        }
+@app.route("/api/uploads/<upload_id>/parts/<int:parte>", methods=["PUT"])
+def upload_part(upload_id, parte):
+    """Recebe uma parte (corpo cru) em disco, em blocos, e grava no bucket; reenviar a mesma parte apenas a substitui"""
+    meta = ler_sessao_upload(upload_id)
+    if meta.get("status", "recebendo") not in ("recebendo", "erro"):
+        raise RequisicaoInvalida("Upload já finalizado")
+    if not 0 <= parte < meta["parts"]:
+        raise RequisicaoInvalida("Parte fora do intervalo")
+    esperado = tamanho_parte(meta, parte)
+    if request.content_length != esperado:
+        raise RequisicaoInvalida(f"A parte {parte} deve ter {esperado} bytes")
 
-        // FUNÇÃO PARA ABRIR EDIÇÃO DA GALERIA
-        function openEditGaleria(img) {
-            document.getElementById('imgCurrent').src = img.url;
-            document.getElementById('editFile').value = ""; // Limpa campo de arquivo
-            document.getElementById('editFormFields').innerHTML = `
-                <div>
-                    <label class="text-xs font-bold text-slate-400 uppercase ml-2 mb-1 block">Tags de Busca</label>
-                    <input type="text" id="fieldTags" value="${img.tags}" class="w-full p-4 bg-slate-50 rounded-2xl font-bold outline-none">
-                </div>
-            `;
-            document.getElementById('editModal').classList.remove('hidden');
-            document.getElementById('saveEditBtn').onclick = () => saveEdit('images', img.name);
-        }
+    with tempfile.NamedTemporaryFile(dir=UPLOAD_TMP_DIR, prefix="parte_") as tmp:
+        # Lê só os bytes esperados: atrás do gunicorn o stream é limitado ao tamanho da parte
+        # e uma leitura além do fim vira 413
+        recebido = 0
+        while recebido < esperado and (bloco := request.stream.read(min(TAMANHO_BLOCO, esperado - recebido))):
+            recebido += len(bloco)
+            tmp.write(bloco)
+        if recebido != esperado:
+            raise RequisicaoInvalida("Parte incompleta")
+        tmp.flush()
+        with open(tmp.name, "rb") as f:
+            cliente_supabase().storage.from_(BUCKET_NAME).upload(
+                path=objeto_upload(upload_id, f"{parte}.part"),
+                file=f,
+                file_options={"content-type": "application/octet-stream", "upsert": "true"}
+            )
+    return jsonify({"part": parte, "size": recebido})
 
-        // FUNÇÃO PARA ABRIR EDIÇÃO DE PROMO
-        function openEditPromo(p) {
-            document.getElementById('imgCurrent').src = p.url_imagem;
-            document.getElementById('editFile').value = "";
-            document.getElementById('editFormFields').innerHTML = `
-                <input type="text" id="fieldTitulo" value="${p.titulo}" class="w-full p-4 bg-slate-50 rounded-2xl font-bold mb-2">
-                <textarea id="fieldTexto" class="w-full p-4 bg-slate-50 rounded-2xl h-32 mb-2 font-medium">${p.texto_informativo}</textarea>
-                <input type="text" id="fieldTag" value="${p.tag}" class="w-full p-4 bg-slate-50 rounded-2xl">
-            `;
-            document.getElementById('editModal').classList.remove('hidden');
-            document.getElementById('saveEditBtn').onclick = () => saveEdit('promotions', p.nome_arquivo);
-        }
+@app.route("/api/uploads/<upload_id>", methods=["DELETE"])
+def cancel_upload(upload_id):
+    ler_sessao_upload(upload_id)
+    apagar_sessao_upload(upload_id)
+    return jsonify({"status": "deleted"})
 
-        // SALVAMENTO COM LÓGICA DE TROCA DE IMAGEM
-        async function saveEdit(type, oldName) {
-            const btn = document.getElementById('saveEditBtn');
-            btn.disabled = true; btn.innerText = "Salvando...";
-
-            const fd = new FormData();
-            fd.append('old_name', oldName);
-            
-            const fileInput = document.getElementById('editFile');
-            if(fileInput.files[0]) {
-                fd.append('image', fileInput.files[0]);
-            }
+@app.route("/api/images", methods=["GET"])
+@cache_listagem
+def list_images():
+    linhas, proximo = listar_pagina("galeria_tags_jundiai", COLUNAS_GALERIA, filtrar_tags(*ler_filtros_tags()))
+    return resposta_paginada([item_galeria(i) for i in linhas], proximo)
 
-            if(type === 'images') {
-                fd.append('tags', document.getElementById('fieldTags').value);
-            } else {
-                fd.append('titulo', document.getElementById('fieldTitulo').value);
-                fd.append('texto', document.getElementById('fieldTexto').value);
-                fd.append('tag', document.getElementById('fieldTag').value);
-            }
+@app.route("/api/images/tags", methods=["GET"])
+@cache_listagem
+def list_image_tags():
+    """Facetas: quantas fotos têm cada tag, dentro do filtro atual"""
+    tags, modo, q = ler_filtros_tags()
+    res = cliente_supabase().rpc("contagem_tags_galeria", {
+        "p_tags": tags or None,
+        "p_todas": modo == "all",
+        "p_q": q or None,
+    }).execute()
+    return jsonify(res.data)
 
-            const res = await fetch(`/api/${type}/update`, {
-                method: 'POST',
-                headers: {'x-app-password': getAuth()},
-                body: fd
-            });
-
-            if(res.ok) {
-                notify("Registro atualizado com sucesso!");
-                closeModal('editModal');
-                type === 'images' ? loadGaleria() : loadPromos();
-            } else {
-                notify("Erro ao atualizar", "error");
-            }
-            btn.disabled = false; btn.innerText = "Salvar Alterações";
-        }
+def gravar_imagem(file, tags):
+    """Sobe a foto e cria a linha da galeria; devolve o item no formato da API"""
+    nome, url, original = upload_imagem_supabase(file, "galeria_tags_jundiai")
+    try:
+        res = cliente_supabase().table("galeria_tags_jundiai").insert({"nome_arquivo": nome, "url_imagem": url, **campos_tags(tags)}).execute()
+    except Exception:
+        # Sem a linha, o blob recém-enviado fica órfão: a fila o coleta se nada mais o usar
+        agendar_remocao(nome)
+        descartar_original(original)
+        raise
+    invalidar_cache()
+    agendar_variantes("galeria_tags_jundiai", nome, original)
+    return item_galeria(res.data[0])
 
-        async function uploadGaleria() {
-            const file = document.getElementById('fileGaleria').files[0];
-            if(!file) return notify("Selecione uma foto!", "error");
-            const fd = new FormData();
-            fd.append('image', file);
-            fd.append('tags', document.getElementById('tagsGaleria').value);
-            await fetch('/api/upload', { method: 'POST', headers: {'x-app-password': getAuth()}, body: fd });
-            notify("Galeria Atualizada!"); loadGaleria();
-        }
+def atualizar_registro(tabela, old_name, dados_update, file, formatar):
+    """Troca os campos (e a imagem, se veio arquivo) da linha old_name; None se a linha não existe mais"""
+    # LÓGICA DE TROCA DE IMAGEM
+    troca = trocar_imagem(tabela, old_name, file)
+    if troca:
+        # 1. Sobe o novo arquivo
+        novo_nome, nova_url, original = troca
+        dados_update["nome_arquivo"] = novo_nome
+        dados_update["url_imagem"] = nova_url
+        dados_update["variantes"] = None
 
-        async function uploadPromo() {
-            const file = document.getElementById('filePromo').files[0];
-            if(!file) return notify("Selecione uma imagem!", "error");
-            const fd = new FormData();
-            fd.append('image', file);
-            fd.append('titulo', document.getElementById('tituloPromo').value);
-            fd.append('texto', document.getElementById('textoPromo').value);
-            fd.append('tag', document.getElementById('tagPromo').value);
-            await fetch('/api/promotions', { method: 'POST', headers: {'x-app-password': getAuth()}, body: fd });
-            notify("Promoção Ativada!"); loadPromos();
-        }
+    # 2. Atualiza o banco; se falhar, o arquivo novo vira órfão e é removido pela fila
+    try:
+        res = cliente_supabase().table(tabela).update(dados_update).eq("nome_arquivo", old_name).execute()
+    except Exception:
+        if troca:
+            agendar_remocao(novo_nome)
+            descartar_original(original)
+        raise
+    if not res.data:
+        # Nenhuma linha com old_name (apagada por outra sessão ou nome errado): o arquivo novo não tem dono
+        if troca:
+            agendar_remocao(novo_nome)
+            descartar_original(original)
+        return None
+    invalidar_cache()
 
-        async function deleteItem(type, name) {
-            if(!confirm("Tem certeza? Esta ação apagará a imagem para sempre.")) return;
-            await fetch(`/api/${type}/${name}`, { method: 'DELETE', headers: {'x-app-password': getAuth()} });
-            type === 'images' ? loadGaleria() : loadPromos();
-            notify("Removido com sucesso!");
-        }
+    # 3. Só depois do banco gravado: libera o antigo e gera as variantes em segundo plano
+    if troca:
+        agendar_remocao(old_name)
+        agendar_variantes(tabela, novo_nome, original)
+    return formatar(res.data[0])
 
-        function logout() { localStorage.removeItem('planeta_auth'); location.reload(); }
-        
-        window.onload = () => { 
-            if(getAuth()) { 
-                document.getElementById('loginPage').classList.add('hidden'); 
-                document.getElementById('mainPage').classList.remove('hidden'); 
-                loadGaleria(); 
-            } 
-            lucide.createIcons(); 
-        };
-    </script>
-</body>
-</html>
-    """)
+def atualizar_imagem(file, old_name, tags):
+    return atualizar_registro("galeria_tags_jundiai", old_name, campos_tags(tags), file, item_galeria)
 
-# --- ROTAS DA API NO BACKEND (PYTHON) ---
+def gravar_promocao(file, titulo, texto, tag):
+    """Sobe a imagem e cria a promoção; devolve o item no formato da API"""
+    nome, url, original = upload_imagem_supabase(file, "promocoes_ativas_jundiai")
+    try:
+        res = cliente_supabase().table("promocoes_ativas_jundiai").insert({
+            "titulo": titulo,
+            "texto_informativo": texto,
+            "tag": tag,
+            "url_imagem": url,
+            "nome_arquivo": nome
+        }).execute()
+    except Exception:
+        # Sem a linha, o blob recém-enviado fica órfão: a fila o coleta se nada mais o usar
+        agendar_remocao(nome)
+        descartar_original(original)
+        raise
+    invalidar_cache()
+    agendar_variantes("promocoes_ativas_jundiai", nome, original)
+    return item_promocao(res.data[0])
 
-@app.route("/api/images", methods=["GET"])
-def list_images():
-    res = supabase.table("galeria_tags_jundiai").select("*").order("created_at", desc=True).execute()
-    return jsonify([{"name": i['nome_arquivo'], "url": i['url_imagem'], "tags": i['tags']} for i in res.data])
+def atualizar_promocao(file, old_name, titulo, texto, tag):
+    dados_update = {"titulo": titulo, "texto_informativo": texto, "tag": tag}
+    return atualizar_registro("promocoes_ativas_jundiai", old_name, dados_update, file, item_promocao)
+
+# Gravações que a tarefa finalizar_upload pode fazer com um arquivo enviado em partes
+GRAVACOES = {
+    "imagem": gravar_imagem,
+    "atualizar_imagem": atualizar_imagem,
+    "promocao": gravar_promocao,
+    "atualizar_promocao": atualizar_promocao,
+}
+
+def resposta_atualizacao(old_name, item):
+    if item is None:
+        return jsonify({"error": "Registro não encontrado", "old_name": old_name}), 404
+    return jsonify({"status": "updated", "old_name": old_name, "item": item})
 
 @app.route("/api/upload", methods=["POST"])
 def upload():
-    file = request.files['image']
     tags = request.form.get('tags', '')
-    nome, url = upload_imagem_supabase(file, "gal")
-    supabase.table("galeria_tags_jundiai").insert({"nome_arquivo": nome, "tags": tags, "url_imagem": url}).execute()
-    return jsonify({"status": "ok"})
+    upload_id = upload_id_do_formulario()
+    if upload_id:
+        return agendar_finalizacao(upload_id, "imagem", tags=tags)
+    if 'image' not in request.files:
+        raise RequisicaoInvalida("Envie o arquivo (image) ou o upload_id de um envio em partes")
+    # Devolve o registro criado para a página inserir o card sem recarregar a lista
+    return jsonify({"status": "ok", "item": gravar_imagem(request.files['image'], tags)})
+
+@app.route("/api/upload/batch", methods=["POST"])
+def upload_batch():
+    """Recebe vários arquivos (campo images) com tags por arquivo e grava todas as linhas num único insert.
+    Arquivos enviados em partes (upload_id) são montados e gravados em segundo plano: status "processando"."""
+    arquivos = request.files.getlist('images')
+    upload_ids = request.form.getlist('upload_id')
+    if not arquivos and not upload_ids:
+        raise RequisicaoInvalida("Nenhum arquivo enviado")
+    total = len(arquivos) + len(upload_ids)
+    if total > BATCH_MAX_ARQUIVOS:
+        raise RequisicaoInvalida(f"Máximo de {BATCH_MAX_ARQUIVOS} arquivos por lote")
+
+    # Uma tag por arquivo, ou uma única tag aplicada a todos (validado antes de montar qualquer upload)
+    tags = request.form.getlist('tags')
+    if len(tags) == 1:
+        tags = tags * total
+    elif not tags:
+        tags = [''] * total
+    elif len(tags) != total:
+        raise RequisicaoInvalida("Envie uma tag por arquivo ou uma única tag para todos")
+
+    resultados = [None] * total
+    # Arquivos já enviados em partes entram no lote depois dos do multipart
+    for i, upload_id in enumerate(upload_ids, start=len(arquivos)):
+        try:
+            meta = iniciar_finalizacao(upload_id, "imagem", tags=tags[i])
+        except UploadNaoEncontrado:
+            resultados[i] = {"upload_id": upload_id, "status": "erro", "error": "Upload não encontrado ou expirado"}
+        except RequisicaoInvalida as erro:
+            resultados[i] = {"upload_id": upload_id, "status": "erro", "error": str(erro)}
+        else:
+            resultados[i] = {"arquivo": meta["filename"], "status": "processando", "upload_id": upload_id}
+
+    def enviar(file):
+        file.stream.seek(0, os.SEEK_END)
+        if file.stream.tell() > app.config["MAX_CONTENT_LENGTH"]:
+            raise RequestEntityTooLarge(f"Arquivo maior que o limite de {MAX_UPLOAD_MB} MB")
+        file.stream.seek(0)
+        return upload_imagem_supabase(file, "galeria_tags_jundiai")
+
+    # 1. Transfere para o storage em paralelo (pool limitado)
+    linhas, enviados, vistos = [], [], set()
+    with ThreadPoolExecutor(max_workers=max(1, min(UPLOAD_CONCURRENCY, len(arquivos)))) as pool:
+        futuros = [pool.submit(enviar, f) for f in arquivos]
+        for i, (file, futuro) in enumerate(zip(arquivos, futuros)):
+            try:
+                nome, url, original = futuro.result()
+            except ImagemDuplicada as erro:
+                resultados[i] = {"arquivo": file.filename, "status": "duplicada", "name": erro.nome_arquivo}
+                continue
+            except Exception as erro:
+                resultados[i] = {"arquivo": file.filename, "status": "erro", "error": str(erro)}
+                continue
+            if nome in vistos:
+                # Mesmo conteúdo repetido dentro do lote: só a primeira cópia vira linha
+                descartar_original(original)
+                resultados[i] = {"arquivo": file.filename, "status": "duplicada", "name": nome}
+                continue
+            vistos.add(nome)
+            linhas.append({"nome_arquivo": nome, "url_imagem": url, **campos_tags(tags[i])})
+            enviados.append((i, file.filename, nome, url, original))
+
+    # 2. Um único insert para todas as linhas que subiram
+    criados = {}
+    if linhas:
+        try:
+            res = cliente_supabase().table("galeria_tags_jundiai").insert(linhas).execute()
+        except Exception as erro:
+            for i, arquivo, nome, url, original in enviados:
+                agendar_remocao(nome)
+                descartar_original(original)
+                resultados[i] = {"arquivo": arquivo, "status": "erro", "error": str(erro)}
+            enviados = []
+        else:
+            invalidar_cache()
+            criados = {linha["nome_arquivo"]: item_galeria(linha) for linha in res.data}
+
+    for i, arquivo, nome, url, original in enviados:
+        agendar_variantes("galeria_tags_jundiai", nome, original)
+        resultados[i] = {"arquivo": arquivo, "status": "ok", "name": nome, "url": url, "tags": tags[i], "item": criados.get(nome)}
+
+    # 207 quando parte do lote falhou; 202 quando ainda há arquivos em processamento
+    estados = {r["status"] for r in resultados}
+    if estados - {"ok", "processando"}:
+        return jsonify({"results": resultados}), 207
+    return jsonify({"results": resultados}), 202 if "processando" in estados else 200
 
 @app.route("/api/images/update", methods=["POST"])
 def update_image():
     old_name = request.form.get('old_name')
     tags = request.form.get('tags')
-    
-    dados_update = {"tags": tags}
-    
-    # LÓGICA DE TROCA DE IMAGEM
-    if 'image' in request.files:
-        # 1. Remove arquivo físico antigo do Storage
-        supabase.storage.from_(BUCKET_NAME).remove([old_name])
-        # 2. Sobe o novo arquivo
-        novo_nome, nova_url = upload_imagem_supabase(request.files['image'], "gal")
-        # 3. Atualiza os nomes no banco de dados
-        dados_update["nome_arquivo"] = novo_nome
-        dados_update["url_imagem"] = nova_url
-    
-    supabase.table("galeria_tags_jundiai").update(dados_update).eq("nome_arquivo", old_name).execute()
-    return jsonify({"status": "updated"})
+    upload_id = upload_id_do_formulario()
+    if upload_id:
+        return agendar_finalizacao(upload_id, "atualizar_imagem", old_name=old_name, tags=tags)
+    return resposta_atualizacao(old_name, atualizar_imagem(request.files.get('image'), old_name, tags))
 
 @app.route("/api/images/<name>", methods=["DELETE"])
 def delete_image(name):
-    supabase.table("galeria_tags_jundiai").delete().eq("nome_arquivo", name).execute()
-    supabase.storage.from_(BUCKET_NAME).remove([name])
-    return jsonify({"status": "deleted"})
+    cliente_supabase().table("galeria_tags_jundiai").delete().eq("nome_arquivo", name).execute()
+    invalidar_cache()
+    agendar_remocao(name)
+    return jsonify({"status": "deleted", "name": name})
+
+@app.route("/api/images/bulk-delete", methods=["POST"])
+def bulk_delete_images():
+    """Apaga várias fotos: {"names": [...]} no corpo e/ou o filtro da listagem (?tag=&match=&q=)"""
+    nomes = ler_nomes_lote()
+    tags, modo, q = ler_filtros_tags()
+    if not nomes and not tags and not q:
+        raise RequisicaoInvalida("Informe names ou um filtro (tag/q)")
+    removidos = apagar_em_lote("galeria_tags_jundiai", nomes, filtrar_tags(tags, modo, q))
+    return jsonify({"status": "deleted", "names": removidos})
+
+@app.route("/api/images/bulk-tags", methods=["POST"])
+def bulk_retag_images():
+    """Acrescenta ("add") e/ou remove ("remove") tags das fotos selecionadas num único update (RPC)"""
+    nomes = ler_nomes_lote()
+    tags, modo, q = ler_filtros_tags()
+    if not nomes and not tags and not q:
+        raise RequisicaoInvalida("Informe names ou um filtro (tag/q)")
+    corpo = request.get_json(silent=True) or {}
+    adicionar = ler_lista_tags(corpo.get("add", []))
+    remover = sorted({normalizar_tag(t) for t in ler_lista_tags(corpo.get("remove", []))} - {""})
+    if not adicionar and not remover:
+        raise RequisicaoInvalida("Informe tags em add ou remove")
+
+    res = cliente_supabase().rpc("retag_galeria", {
+        "p_nomes": nomes or None,
+        "p_tags": tags or None,
+        "p_todas": modo == "all",
+        "p_q": q or None,
+        "p_adicionar": adicionar,
+        "p_remover": remover,
+    }).execute()
+    if res.data:
+        invalidar_cache()
+    return jsonify({"status": "updated", "items": [item_galeria(linha) for linha in res.data]})
 
 @app.route("/api/promotions", methods=["GET"])
+@cache_listagem
 def list_promotions():
-    res = supabase.table("promocoes_ativas_jundiai").select("*").order("created_at", desc=True).execute()
-    return jsonify(res.data)
+    linhas, proximo = listar_pagina("promocoes_ativas_jundiai", COLUNAS_PROMOCOES)
+    return resposta_paginada([item_promocao(p) for p in linhas], proximo)
 
 @app.route("/api/promotions", methods=["POST"])
 def upload_promotion():
-    file = request.files['image']
-    nome, url = upload_imagem_supabase(file, "promo")
-    supabase.table("promocoes_ativas_jundiai").insert({
-        "titulo": request.form.get('titulo'),
-        "texto_informativo": request.form.get('texto'),
-        "tag": request.form.get('tag'),
-        "url_imagem": url,
-        "nome_arquivo": nome
-    }).execute()
-    return jsonify({"status": "ok"})
+    campos = {"titulo": request.form.get('titulo'), "texto": request.form.get('texto'), "tag": request.form.get('tag')}
+    upload_id = upload_id_do_formulario()
+    if upload_id:
+        return agendar_finalizacao(upload_id, "promocao", **campos)
+    if 'image' not in request.files:
+        raise RequisicaoInvalida("Envie o arquivo (image) ou o upload_id de um envio em partes")
+    return jsonify({"status": "ok", "item": gravar_promocao(request.files['image'], **campos)})
 
 @app.route("/api/promotions/update", methods=["POST"])
 def update_promotion():
     old_name = request.form.get('old_name')
-    dados_update = {
-        "titulo": request.form.get('titulo'),
-        "texto_informativo": request.form.get('texto'),
-        "tag": request.form.get('tag')
-    }
-    
-    # LÓGICA DE TROCA DE IMAGEM
-    if 'image' in request.files:
-        supabase.storage.from_(BUCKET_NAME).remove([old_name])
-        novo_nome, nova_url = upload_imagem_supabase(request.files['image'], "promo")
-        dados_update["nome_arquivo"] = novo_nome
-        dados_update["url_imagem"] = nova_url
-    
-    supabase.table("promocoes_ativas_jundiai").update(dados_update).eq("nome_arquivo", old_name).execute()
-    return jsonify({"status": "updated"})
+    campos = {"titulo": request.form.get('titulo'), "texto": request.form.get('texto'), "tag": request.form.get('tag')}
+    upload_id = upload_id_do_formulario()
+    if upload_id:
+        return agendar_finalizacao(upload_id, "atualizar_promocao", old_name=old_name, **campos)
+    return resposta_atualizacao(old_name, atualizar_promocao(request.files.get('image'), old_name, **campos))
 
 @app.route("/api/promotions/<name>", methods=["DELETE"])
 def delete_promotion(name):
-    supabase.table("promocoes_ativas_jundiai").delete().eq("nome_arquivo", name).execute()
-    supabase.storage.from_(BUCKET_NAME).remove([name])
-    return jsonify({"status": "deleted"})
+    cliente_supabase().table("promocoes_ativas_jundiai").delete().eq("nome_arquivo", name).execute()
+    invalidar_cache()
+    agendar_remocao(name)
+    return jsonify({"status": "deleted", "name": name})
+
+@app.route("/api/promotions/bulk-delete", methods=["POST"])
+def bulk_delete_promotions():
+    """Apaga várias promoções: {"names": [...]} no corpo e/ou ?tag= (tag exata da campanha)"""
+    nomes = ler_nomes_lote()
+    tag = request.args.get("tag")
+    if not nomes and not tag:
+        raise RequisicaoInvalida("Informe names ou tag")
+    removidos = apagar_em_lote("promocoes_ativas_jundiai", nomes, lambda consulta: consulta.eq("tag", tag) if tag else consulta)
+    return jsonify({"status": "deleted", "names": removidos})
+
+@app.route("/api/changes", methods=["GET"])
+def list_changes():
+    """Alterações desde ?since=: upserts com o item completo e lápides (op=delete) para remoções.
+    ?wait=N segura a resposta até N segundos quando não há nada novo;
+    com Accept: text/event-stream a conexão fica aberta e cada lote vira um evento.
+    Um token mais velho que CHANGES_RETENTION_DAYS recebe 410: o consumidor recarrega tudo sem since."""
+    limite = ler_limite()
+    since = request.args.get("since") or request.headers.get("Last-Event-ID")
+    posicoes = decodificar_token(since)
+    # Poda das lápides no máximo uma vez por hora, puxada pelos próprios consumidores
+    enfileirar("podar_remocoes", chave="podar_remocoes", atraso=3600)
+
+    if request.accept_mimetypes.best == "text/event-stream":
+        resposta = Response(stream_with_context(eventos_alteracoes(posicoes, limite)), mimetype="text/event-stream")
+        resposta.headers["Cache-Control"] = "no-cache"
+        resposta.headers["X-Accel-Buffering"] = "no"
+        return resposta
+
+    try:
+        espera = min(max(float(request.args.get("wait", 0)), 0), CHANGES_WAIT_MAX)
+    except ValueError:
+        raise RequisicaoInvalida("Parâmetro wait inválido")
+    prazo = time.monotonic() + espera
+
+    geracao = geracao_atual()
+    alteracoes, novas, ha_mais = buscar_alteracoes(posicoes, limite)
+    # A primeira espera é só a janela: pega escritas feitas pouco antes do pedido, ainda não assentadas
+    intervalo = CHANGES_SETTLE
+    while not alteracoes and time.monotonic() < prazo:
+        esperar_escrita(geracao, min(prazo - time.monotonic(), intervalo))
+        intervalo = CHANGES_POLL
+        geracao = geracao_atual()
+        alteracoes, novas, ha_mais = buscar_alteracoes(posicoes, limite)
+
+    with etapa("json"):
+        resposta = jsonify({"changes": alteracoes, "next": codificar_token(novas), "has_more": ha_mais})
+    resposta.headers["Cache-Control"] = "no-store"
+    return resposta
+
+def create_app():
+    """Fábrica usada pelo gunicorn (app:create_app()): confere a configuração e mede a subida.
+    Sem rede e sem imports pesados: clientes Supabase/httpx e Pillow nascem no primeiro uso, em cada worker."""
+    faltando = [v for v in ("SUPABASE_URL", "SUPABASE_KEY", "BUCKET_NAME", "APP_PASSWORD") if not os.getenv(v)]
+    if faltando:
+        app.logger.warning("Variáveis não configuradas: %s (as rotas que dependem delas vão falhar)", ", ".join(faltando))
+
+    duracao = time.perf_counter() - _INICIO_IMPORT
+    observar("galeria_startup_seconds", {}, duracao)
+    if duracao * 1000 > STARTUP_BUDGET_MS:
+        app.logger.warning("Subida levou %.0f ms (orçamento de %d ms); rode python -m bench.startup", duracao * 1000, STARTUP_BUDGET_MS)
+    return app
 
 if __name__ == "__main__":
     # Rodar o app
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    create_app().run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,473 @@
+"""Servidor HTTP local que imita o subconjunto do Supabase usado pelo app.py.
+
+Implementa o suficiente do PostgREST (select/insert/update/delete com os filtros
+eq, neq, lt, lte, gt, gte, in, cs, ov, ilike, is e or/and), das RPCs do app, do
+Storage (upload, remoção, listagem de pastas, leitura) e do upload resumable (TUS), com
+latência configurável por requisição.
+
+Uso isolado: python -m bench.fake_supabase --port 54321 --latency-ms 20
+Rotas de controle: POST /_bench/seed {"table": ..., "rows": N} e POST /_bench/reset
+"""
+import argparse
+import base64
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+class Banco:
+    """Tabelas em memória e blobs do storage em disco"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tabelas = {}
+        self.pasta = tempfile.mkdtemp(prefix="fake_storage_")
+        self.uploads = {}
+
+    def reset(self):
+        with self.lock:
+            self.tabelas.clear()
+            self.uploads.clear()
+            shutil.rmtree(self.pasta, ignore_errors=True)
+            os.makedirs(self.pasta)
+
+    def tabela(self, nome):
+        return self.tabelas.setdefault(nome, [])
+
+    def registrar_remocao(self, tabela, nome):
+        """Mesmo efeito dos triggers da migração 004 (chamar com o lock)"""
+        if tabela == "registro_remocoes":
+            return
+        lapides = self.tabela("registro_remocoes")
+        lapides.append({"id": max((l["id"] for l in lapides), default=0) + 1, "tabela": tabela, "nome_arquivo": nome, "removido_em": agora_iso()})
+
+    def caminho_blob(self, bucket, nome):
+        # Pastas do bucket viram pastas no disco, para a listagem (object/list)
+        return os.path.join(self.pasta, bucket, *nome.strip("/").split("/"))
+
+def agora_iso(delta=0.0):
+    return (datetime.now(timezone.utc) + timedelta(seconds=delta)).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+# --- FILTROS POSTGREST ---
+
+def dividir_topo(texto):
+    """Separa por vírgulas que não estão dentro de parênteses, chaves ou aspas"""
+    partes, nivel, aspas, atual = [], 0, False, ""
+    for c in texto:
+        if c == '"':
+            aspas = not aspas
+        elif not aspas and c in "({":
+            nivel += 1
+        elif not aspas and c in ")}":
+            nivel -= 1
+        if c == "," and nivel == 0 and not aspas:
+            partes.append(atual)
+            atual = ""
+        else:
+            atual += c
+    if atual:
+        partes.append(atual)
+    return partes
+
+def sem_aspas(valor):
+    return valor[1:-1] if len(valor) >= 2 and valor[0] == valor[-1] == '"' else valor
+
+def lista_pg(valor):
+    """'{a,b}' ou '(a,b)' -> ['a', 'b']"""
+    return [sem_aspas(v.strip()) for v in dividir_topo(valor[1:-1])] if len(valor) > 2 else []
+
+def comparar(campo, operador, valor):
+    if operador == "is":
+        return campo is None if valor == "null" else campo == (valor == "true")
+    if operador == "in":
+        return str(campo) in lista_pg(valor)
+    if operador == "cs":
+        return set(lista_pg(valor)) <= set(campo or [])
+    if operador == "ov":
+        return bool(set(lista_pg(valor)) & set(campo or []))
+    if operador in ("like", "ilike"):
+        padrao = re.escape(sem_aspas(valor)).replace("%", ".*").replace(r"\*", ".*")
+        return campo is not None and re.fullmatch(padrao, str(campo), re.I if operador == "ilike" else 0) is not None
+    valor = sem_aspas(valor)
+    if campo is None:
+        return False
+    if isinstance(campo, (int, float)) and not isinstance(campo, bool):
+        valor = float(valor)
+    return {
+        "eq": campo == valor, "neq": campo != valor,
+        "lt": campo < valor, "lte": campo <= valor,
+        "gt": campo > valor, "gte": campo >= valor,
+    }[operador]
+
+def condicao(texto):
+    """Compila 'col.op.valor', 'not.col.op.valor', 'and(...)' ou 'or(...)' numa função"""
+    if texto.startswith(("and(", "or(")):
+        modo, corpo = texto.split("(", 1)
+        filhos = [condicao(p) for p in dividir_topo(corpo[:-1])]
+        return (lambda l: all(f(l) for f in filhos)) if modo == "and" else (lambda l: any(f(l) for f in filhos))
+    coluna, resto = texto.split(".", 1)
+    negar = resto.startswith("not.")
+    if negar:
+        resto = resto[4:]
+    operador, valor = resto.split(".", 1)
+    return lambda l: comparar(l.get(coluna), operador, valor) != negar
+
+def filtros_da_query(params):
+    filtros = []
+    for chave, valor in params:
+        if chave in ("select", "order", "limit", "offset", "columns", "on_conflict"):
+            continue
+        if chave in ("or", "and"):
+            filtros.append(condicao(f"{chave}{valor}"))
+        else:
+            filtros.append(condicao(f"{chave}.{valor}"))
+    return lambda l: all(f(l) for f in filtros)
+
+def ordenar(linhas, ordem):
+    for parte in reversed(ordem.split(",")):
+        coluna, *mods = parte.split(".")
+        linhas.sort(key=lambda l: (l.get(coluna) is None, l.get(coluna) or ""), reverse="desc" in mods)
+    return linhas
+
+def projetar(linha, select):
+    if not select or select == "*":
+        return dict(linha)
+    return {c: linha.get(c) for c in select.split(",")}
+
+# --- RPCs DO APP ---
+
+def rpc_contagem_tags_galeria(banco, p_tags=None, p_todas=True, p_q=None):
+    contagem = {}
+    for linha in banco.tabela("galeria_tags_jundiai"):
+        tags = set(linha.get("tags_norm") or [])
+        if p_tags and not (set(p_tags) <= tags if p_todas else set(p_tags) & tags):
+            continue
+        if p_q and p_q not in (linha.get("tags_busca") or ""):
+            continue
+        for tag in tags:
+            contagem[tag] = contagem.get(tag, 0) + 1
+    return [{"tag": t, "total": n} for t, n in sorted(contagem.items(), key=lambda i: (-i[1], i[0]))]
+
+def rpc_blob_referencias(banco, p_nome):
+    return sum(
+        1 for tabela in ("galeria_tags_jundiai", "promocoes_ativas_jundiai")
+        for linha in banco.tabela(tabela) if linha.get("nome_arquivo") == p_nome
+    )
+
+def rpc_blobs_sem_referencia(banco, p_nomes):
+    return [{"nome_arquivo": n} for n in p_nomes if not rpc_blob_referencias(banco, n)]
+
+def normalizar_tag(tag):
+    tag = unicodedata.normalize("NFKD", tag).encode("ascii", "ignore").decode("ascii").lower()
+    return re.sub(r"\s+", " ", re.sub(r"[^a-z0-9 _-]", "", tag)).strip()
+
+def rpc_retag_galeria(banco, p_nomes=None, p_tags=None, p_todas=True, p_q=None, p_adicionar=(), p_remover=()):
+    if p_nomes is None and p_tags is None and p_q is None:
+        return []
+    alteradas = []
+    for linha in banco.tabela("galeria_tags_jundiai"):
+        norm = set(linha.get("tags_norm") or [])
+        if p_nomes is not None and linha["nome_arquivo"] not in p_nomes:
+            continue
+        if p_tags and not (set(p_tags) <= norm if p_todas else set(p_tags) & norm):
+            continue
+        if p_q and p_q not in (linha.get("tags_busca") or ""):
+            continue
+        mantidas = {}
+        for texto in [t.strip() for t in (linha.get("tags") or "").split(",")] + [t.strip() for t in p_adicionar or []]:
+            chave = normalizar_tag(texto)
+            if chave and chave not in (p_remover or []):
+                mantidas.setdefault(chave, texto)
+        tags = ", ".join(mantidas.values())
+        if tags != linha.get("tags"):
+            linha.update(tags=tags, tags_norm=sorted(mantidas), tags_busca=" ".join(sorted(mantidas)), updated_at=agora_iso())
+            alteradas.append(dict(linha))
+    return alteradas
+
+RPCS = {
+    "contagem_tags_galeria": rpc_contagem_tags_galeria,
+    "blob_referencias": rpc_blob_referencias,
+    "blobs_sem_referencia": rpc_blobs_sem_referencia,
+    "retag_galeria": rpc_retag_galeria,
+}
+
+# --- SERVIDOR ---
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Cabeçalhos e corpo numa única escrita e sem Nagle: sem o piso de ~40 ms do ACK atrasado
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    banco = None
+    latencia = 0.0
+
+    def log_message(self, *args):
+        pass
+
+    def corpo(self):
+        return self._corpo
+
+    def responder(self, status, dados=None, cabecalhos=None, bruto=None, tipo="application/json"):
+        corpo = bruto if bruto is not None else (b"" if dados is None else json.dumps(dados).encode())
+        self.send_response(status)
+        self.send_header("content-type", tipo)
+        self.send_header("content-length", str(len(corpo)))
+        for k, v in (cabecalhos or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(corpo)
+
+    def rota(self):
+        # Lê o corpo sempre, antes de rotear: o postgrest-py manda json={} até em select/delete,
+        # e bytes não lidos corromperiam o próximo request da conexão keep-alive
+        tamanho = int(self.headers.get("content-length") or 0)
+        self._corpo = self.rfile.read(tamanho) if tamanho else b""
+        if self.latencia:
+            time.sleep(self.latencia)
+        partes = urlsplit(self.path)
+        caminho = unquote(partes.path)
+        params = parse_qsl(partes.query, keep_blank_values=True)
+        try:
+            if caminho.startswith("/_bench/"):
+                return self.controle(caminho, json.loads(self.corpo() or b"{}"))
+            if caminho.startswith("/rest/v1/rpc/"):
+                return self.rpc(caminho.rsplit("/", 1)[1])
+            if caminho.startswith("/rest/v1/"):
+                return self.rest(caminho[len("/rest/v1/"):], params)
+            if caminho.startswith("/storage/v1/upload/resumable"):
+                return self.tus(caminho)
+            if caminho.startswith("/storage/v1/object/"):
+                return self.storage(caminho[len("/storage/v1/object/"):])
+            self.responder(404, {"message": "rota desconhecida"})
+        except Exception as erro:
+            self.responder(500, {"message": repr(erro)})
+
+    do_GET = do_POST = do_PATCH = do_DELETE = do_PUT = do_HEAD = rota
+
+    # Controle do benchmark
+    def controle(self, caminho, dados):
+        if caminho == "/_bench/reset":
+            self.banco.reset()
+            return self.responder(200, {"ok": True})
+        if caminho == "/_bench/seed":
+            linhas = gerar_linhas(dados["table"], int(dados["rows"]))
+            with self.banco.lock:
+                self.banco.tabela(dados["table"]).extend(linhas)
+            return self.responder(200, {"rows": len(linhas)})
+        if caminho == "/_bench/stats":
+            with self.banco.lock:
+                return self.responder(200, {t: len(l) for t, l in self.banco.tabelas.items()})
+        self.responder(404, {})
+
+    # PostgREST
+    def rest(self, tabela, params):
+        banco = self.banco
+        filtro = filtros_da_query(params)
+        query = dict(params)
+        with banco.lock:
+            linhas = banco.tabela(tabela)
+            if self.command in ("GET", "HEAD"):
+                resultado = ordenar([l for l in linhas if filtro(l)], query.get("order", ""))
+                inicio = int(query.get("offset", 0))
+                if "limit" in query:
+                    resultado = resultado[inicio:inicio + int(query["limit"])]
+                return self.responder(200, [projetar(l, query.get("select")) for l in resultado])
+
+            if self.command == "POST":
+                novos = json.loads(self.corpo())
+                novos = novos if isinstance(novos, list) else [novos]
+                for i, linha in enumerate(novos):
+                    linha.setdefault("created_at", agora_iso(i * 1e-6))
+                    linha.setdefault("updated_at", linha["created_at"])
+                    linha.setdefault("id", len(linhas) + i + 1)
+                linhas.extend(novos)
+                return self.responder(201, novos)
+
+            if self.command == "PATCH":
+                dados = json.loads(self.corpo())
+                alterados = [l for l in linhas if filtro(l)]
+                for l in alterados:
+                    if "nome_arquivo" in dados and dados["nome_arquivo"] != l.get("nome_arquivo"):
+                        banco.registrar_remocao(tabela, l["nome_arquivo"])
+                    l.update(dados, updated_at=agora_iso())
+                return self.responder(200, alterados)
+
+            if self.command == "DELETE":
+                removidos = [l for l in linhas if filtro(l)]
+                banco.tabelas[tabela] = [l for l in linhas if not filtro(l)]
+                for l in removidos:
+                    banco.registrar_remocao(tabela, l.get("nome_arquivo"))
+                return self.responder(200, removidos)
+        self.responder(405, {})
+
+    def rpc(self, nome):
+        funcao = RPCS.get(nome)
+        if not funcao:
+            return self.responder(404, {"message": f"função {nome} não existe no fake"})
+        argumentos = json.loads(self.corpo() or b"{}")
+        with self.banco.lock:
+            self.responder(200, funcao(self.banco, **argumentos))
+
+    # Storage
+    def storage(self, resto):
+        banco = self.banco
+        if self.command == "GET":
+            publico = resto.startswith("public/")
+            bucket, nome = (resto[len("public/"):] if publico else resto).split("/", 1)
+            caminho = banco.caminho_blob(bucket, nome)
+            if not os.path.isfile(caminho):
+                return self.responder(404, {"message": "Object not found"})
+            with open(caminho, "rb") as f:
+                return self.responder(200, bruto=f.read(), tipo="application/octet-stream")
+
+        if self.command == "DELETE":
+            bucket = resto.strip("/")
+            nomes = json.loads(self.corpo()).get("prefixes", [])
+            removidos = []
+            for nome in nomes:
+                caminho = banco.caminho_blob(bucket, nome)
+                if os.path.isfile(caminho):
+                    os.remove(caminho)
+                    removidos.append({"name": nome})
+                    # Como no Supabase, pastas vazias deixam de existir
+                    pasta = os.path.dirname(caminho)
+                    while pasta != os.path.join(banco.pasta, bucket) and not os.listdir(pasta):
+                        os.rmdir(pasta)
+                        pasta = os.path.dirname(pasta)
+            return self.responder(200, removidos)
+
+        if self.command == "POST" and resto.startswith("list/"):
+            return self.listar(resto[len("list/"):], json.loads(self.corpo() or b"{}"))
+
+        # POST (upload) / PUT (update): multipart com o campo "file"
+        bucket, nome = resto.split("/", 1)
+        caminho = banco.caminho_blob(bucket, nome)
+        upsert = self.headers.get("x-upsert") == "true" or self.command == "PUT"
+        if os.path.exists(caminho) and not upsert:
+            return self.responder(400, {"statusCode": "409", "error": "Duplicate", "message": "The resource already exists"})
+        conteudo = extrair_arquivo(self.corpo(), self.headers.get("content-type", ""))
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, "wb") as f:
+            f.write(conteudo)
+        self.responder(200, {"Key": f"{bucket}/{nome}", "Id": str(uuid.uuid4())})
+
+    def listar(self, bucket, opcoes):
+        """Conteúdo direto de uma pasta: arquivos com datas e metadados, subpastas com id null"""
+        pasta = self.banco.caminho_blob(bucket, opcoes.get("prefix") or "")
+        busca = opcoes.get("search") or ""
+        itens = []
+        if os.path.isdir(pasta):
+            for entrada in sorted(os.scandir(pasta), key=lambda e: e.name):
+                if not entrada.name.startswith(busca) or entrada.name.endswith(".parcial"):
+                    continue
+                if entrada.is_dir():
+                    itens.append({"name": entrada.name, "id": None, "updated_at": None, "created_at": None, "metadata": None})
+                    continue
+                info = entrada.stat()
+                modificado = datetime.fromtimestamp(info.st_mtime, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+                itens.append({
+                    "name": entrada.name, "id": str(uuid.uuid5(uuid.NAMESPACE_URL, entrada.path)),
+                    "updated_at": modificado, "created_at": modificado,
+                    "metadata": {"size": info.st_size, "mimetype": "application/octet-stream"},
+                })
+        inicio = int(opcoes.get("offset", 0))
+        self.responder(200, itens[inicio:inicio + int(opcoes.get("limit", 100))])
+
+    # TUS (upload resumable)
+    def tus(self, caminho):
+        banco = self.banco
+        cabecalhos = {"tus-resumable": "1.0.0"}
+        if self.command == "POST":
+            metadados = dict(
+                (k, base64.b64decode(v).decode())
+                for k, v in (item.split(" ") for item in self.headers["upload-metadata"].split(","))
+            )
+            upload_id = uuid.uuid4().hex
+            destino = banco.caminho_blob(metadados["bucketName"], metadados["objectName"])
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            open(destino + ".parcial", "wb").close()
+            banco.uploads[upload_id] = {"destino": destino, "tamanho": int(self.headers["upload-length"]), "offset": 0}
+            return self.responder(201, cabecalhos={**cabecalhos, "location": f"/storage/v1/upload/resumable/{upload_id}"})
+
+        upload = banco.uploads.get(caminho.rsplit("/", 1)[1])
+        if not upload:
+            return self.responder(404, {})
+        if self.command == "PATCH":
+            if int(self.headers["upload-offset"]) != upload["offset"]:
+                return self.responder(409, {}, cabecalhos)
+            parte = self.corpo()
+            with open(upload["destino"] + ".parcial", "ab") as f:
+                f.write(parte)
+            upload["offset"] += len(parte)
+            if upload["offset"] >= upload["tamanho"]:
+                os.replace(upload["destino"] + ".parcial", upload["destino"])
+            return self.responder(204, cabecalhos={**cabecalhos, "upload-offset": str(upload["offset"])})
+        self.responder(200, cabecalhos={**cabecalhos, "upload-offset": str(upload["offset"]), "upload-length": str(upload["tamanho"])})
+
+def extrair_arquivo(corpo, content_type):
+    """Conteúdo do primeiro campo de arquivo de um corpo multipart/form-data"""
+    if "boundary=" not in content_type:
+        return corpo
+    fronteira = b"--" + content_type.split("boundary=", 1)[1].strip('"').encode()
+    for parte in corpo.split(fronteira):
+        if b'filename="' in parte.split(b"\r\n\r\n", 1)[0]:
+            conteudo = parte.split(b"\r\n\r\n", 1)[1]
+            return conteudo[:-2] if conteudo.endswith(b"\r\n") else conteudo
+    return b""
+
+def gerar_linhas(tabela, quantidade):
+    """Linhas sintéticas, da mais nova para a mais antiga"""
+    tags = ["Unhas", "Noivas", "Preços", "Cabelo", "Maquiagem", "Sobrancelha"]
+    base = datetime.now(timezone.utc)
+    linhas = []
+    for i in range(quantidade):
+        nome = f"seed_{i:08d}.jpg"
+        escolhidas = [tags[i % len(tags)], tags[(i * 7) % len(tags)]]
+        normalizadas = sorted({t.lower().replace("ç", "c") for t in escolhidas})
+        criado = (base - timedelta(seconds=i)).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+        linha = {
+            "id": i + 1,
+            "nome_arquivo": nome,
+            "url_imagem": f"http://fake/storage/v1/object/public/bench/{nome}",
+            "variantes": None,
+            "created_at": criado,
+            "updated_at": criado,
+        }
+        if tabela == "galeria_tags_jundiai":
+            linha.update({"tags": ", ".join(escolhidas), "tags_norm": normalizadas, "tags_busca": " ".join(normalizadas)})
+        else:
+            linha.update({"titulo": f"Promo {i}", "texto_informativo": "Oferta de teste", "tag": f"promo_{i}"})
+        linhas.append(linha)
+    return linhas
+
+def iniciar(port=0, latencia_ms=0.0):
+    """Sobe o servidor numa thread e devolve (servidor, url base)"""
+    handler = type("HandlerConfigurado", (Handler,), {"banco": Banco(), "latencia": latencia_ms / 1000})
+    servidor = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f"http://127.0.0.1:{servidor.server_address[1]}"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    servidor, url = iniciar(args.port, args.latency_ms)
+    print(url, flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        servidor.shutdown()
+
+if __name__ == "__main__":
+    main()
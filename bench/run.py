@@ -0,0 +1,409 @@
+"""Benchmark das rotas do app.py contra o Supabase falso (bench/fake_supabase.py).
+
+Mede p50/p95/p99, vazão e pico de RSS do processo do app para:
+- listagem /api/images com 100, 10k e 100k linhas
+- upload único e concorrente de arquivos de 1 a 20 MB, em multipart e em partes
+  (/api/uploads: sessão, PUT das partes e o POST que responde 202)
+- troca de imagem (update) e remoção (delete)
+
+O Supabase falso e o app rodam cada um no seu processo, fora do gerador de carga:
+o app sobe como em produção (gunicorn -c gunicorn.conf.py "app:create_app()", workers
+gevent) e o RSS medido é a soma do master, dos workers e dos pools de imagem deles.
+
+Uso:
+    python -m bench.run                         # todos os cenários
+    python -m bench.run --only list --rows 100,10000
+    python -m bench.run --json atual.json --baseline anterior.json --tolerance 0.2
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+SENHA = "bench"
+# Formato de JWT, como uma chave real do Supabase
+CHAVE_FALSA = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoic2VydmljZV9yb2xlIn0.bench"
+
+def subir_fake(latencia_ms):
+    """Sobe o Supabase falso em outro processo e devolve (processo, url)"""
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "bench.fake_supabase", "--port", "0", "--latency-ms", str(latencia_ms)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    return processo, processo.stdout.readline().strip()
+
+def configurar_ambiente(url_fake, pasta):
+    """Variáveis lidas pelo app.py; precisam existir antes do import"""
+    os.environ.update({
+        "SUPABASE_URL": url_fake,
+        "SUPABASE_KEY": CHAVE_FALSA,
+        "BUCKET_NAME": "bench",
+        "APP_PASSWORD": SENHA,
+        "JOBS_DB": os.path.join(pasta, "jobs.sqlite3"),
+        "CACHE_GENERATION_FILE": os.path.join(pasta, "geracao"),
+        "UPLOAD_TMP_DIR": pasta,
+        "LIST_CACHE_TTL": "0",   # mede a origem, não o cache
+        "JOB_WORKERS": os.environ.get("JOB_WORKERS", "0"),
+        "MAX_UPLOAD_MB": "32",
+        "HTTP2": "0",
+    })
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def subir_app(pasta, workers):
+    """Sobe o app com o gunicorn.conf.py do projeto em outro processo e espera ele responder.
+    Sem access log; o que o app escrever vai para <pasta>/app.log, fora da tabela de resultados."""
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    porta = porta_livre()
+    log = open(os.path.join(pasta, "app.log"), "w")
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{porta}", "app:create_app()"],
+        cwd=raiz, env={**os.environ, "WEB_CONCURRENCY": str(workers)}, stdout=log, stderr=log,
+    )
+    url = f"http://127.0.0.1:{porta}"
+    prazo = time.monotonic() + 30
+    while time.monotonic() < prazo:
+        if processo.poll() is not None:
+            break
+        try:
+            if httpx.get(f"{url}/metrics", timeout=1).status_code == 200:
+                return processo, url
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    processo.terminate()
+    raise RuntimeError(f"O app não subiu; veja {log.name}")
+
+class MedidorRSS:
+    """Amostra a cada 10 ms o RSS do processo do app e de todos os descendentes e guarda o pico do cenário"""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.pico = 0
+        self._parar = threading.Event()
+
+    @staticmethod
+    def descendentes(pid):
+        pids = [pid]
+        for atual in pids:
+            try:
+                with open(f"/proc/{atual}/task/{atual}/children") as f:
+                    pids += [int(p) for p in f.read().split()]
+            except OSError:
+                pass
+        return pids
+
+    def rss_atual(self):
+        total = 0
+        for pid in self.descendentes(self.pid):
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for linha in f:
+                        if linha.startswith("VmRSS:"):
+                            total += int(linha.split()[1]) * 1024
+            except OSError:
+                pass  # o processo terminou entre a listagem e a leitura
+        return total
+
+    def __enter__(self):
+        self.pico = self.rss_atual()
+        def amostrar():
+            while not self._parar.wait(0.01):
+                self.pico = max(self.pico, self.rss_atual())
+        self._thread = threading.Thread(target=amostrar, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+PID_APP = None
+
+def medir(nome, operacao, total, concorrencia=1):
+    """Executa operacao(i) total vezes com a concorrência dada e resume as latências"""
+    latencias, erros = [], 0
+    lock = threading.Lock()
+
+    def uma(i):
+        nonlocal erros
+        inicio = time.perf_counter()
+        try:
+            ok = operacao(i)
+        except httpx.HTTPError:
+            ok = False
+        duracao = (time.perf_counter() - inicio) * 1000
+        with lock:
+            latencias.append(duracao)
+            erros += 0 if ok else 1
+
+    with MedidorRSS(PID_APP) as rss:
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concorrencia) as pool:
+            list(pool.map(uma, range(total)))
+        duracao = time.perf_counter() - inicio
+
+    return {
+        "cenario": nome,
+        "n": total,
+        "concorrencia": concorrencia,
+        "p50_ms": round(percentil(latencias, 50), 2),
+        "p95_ms": round(percentil(latencias, 95), 2),
+        "p99_ms": round(percentil(latencias, 99), 2),
+        "media_ms": round(statistics.fmean(latencias), 2) if latencias else 0.0,
+        "req_s": round(total / duracao, 2) if duracao else 0.0,
+        "pico_rss_mb": round(rss.pico / 1024 / 1024, 1),
+        "erros": erros,
+        "erros_pct": round(100 * erros / total, 1) if total else 0.0,
+    }
+
+def arquivo_imagem(pasta, megabytes):
+    """JPEG válido completado com bytes aleatórios até o tamanho pedido (decodificadores ignoram o excesso)"""
+    caminho = os.path.join(pasta, f"bench_{megabytes}mb.jpg")
+    if os.path.exists(caminho):
+        return caminho
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (1600, 1200), (200, 120, 80)).save(buffer, "JPEG", quality=85)
+    with open(caminho, "wb") as f:
+        f.write(buffer.getvalue())
+        restante = megabytes * 1024 * 1024 - buffer.tell()
+        while restante > 0:
+            bloco = os.urandom(min(restante, 1024 * 1024))
+            f.write(bloco)
+            restante -= len(bloco)
+    return caminho
+
+class ArquivoUnico(io.RawIOBase):
+    """Lê o arquivo base seguido de um sufixo aleatório: cada envio tem outro SHA-256
+    (o app deduplica uploads idênticos, o que esconderia o custo da transferência)"""
+
+    def __init__(self, caminho):
+        self._arquivo = open(caminho, "rb")
+        self._base = os.path.getsize(caminho)
+        self._sufixo = uuid.uuid4().bytes
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        total = self._base + len(self._sufixo)
+        self._pos = {io.SEEK_SET: pos, io.SEEK_CUR: self._pos + pos, io.SEEK_END: total + pos}[whence]
+        return self._pos
+
+    def read(self, n=-1):
+        total = self._base + len(self._sufixo)
+        n = total - self._pos if n is None or n < 0 else min(n, total - self._pos)
+        dados = b""
+        if self._pos < self._base:
+            self._arquivo.seek(self._pos)
+            dados = self._arquivo.read(min(n, self._base - self._pos))
+        falta = n - len(dados)
+        if falta > 0:
+            inicio = self._pos + len(dados) - self._base
+            dados += self._sufixo[inicio:inicio + falta]
+        self._pos += len(dados)
+        return dados
+
+    def close(self):
+        self._arquivo.close()
+        super().close()
+
+def controle(http_fake, rota, **dados):
+    http_fake.post(f"/_bench/{rota}", json=dados).raise_for_status()
+
+def cenario_listagem(http_app, http_fake, linhas_por_cenario, repeticoes):
+    resultados = []
+    for linhas in linhas_por_cenario:
+        controle(http_fake, "reset")
+        controle(http_fake, "seed", table="galeria_tags_jundiai", rows=linhas)
+        # Primeira página e uma página no meio da tabela (cursor)
+        cursor = http_app.get("/api/images", params={"limit": 100}).headers.get("X-Next-Cursor")
+        resultados.append(medir(
+            f"list {linhas} linhas",
+            lambda i: http_app.get("/api/images").status_code == 200,
+            repeticoes,
+        ))
+        resultados.append(medir(
+            f"list {linhas} linhas (cursor)",
+            lambda i: http_app.get("/api/images", params={"cursor": cursor}).status_code == 200,
+            repeticoes,
+        ))
+        resultados.append(medir(
+            f"list {linhas} linhas (tag)",
+            lambda i: http_app.get("/api/images", params={"tag": "noivas"}).status_code == 200,
+            repeticoes,
+        ))
+    return resultados
+
+def enviar(http_app, caminho, rota="/api/upload", **campos):
+    with ArquivoUnico(caminho) as f:
+        resposta = http_app.post(rota, data={"tags": "bench", **campos}, files={"image": ("foto.jpg", f, "image/jpeg")})
+    return resposta
+
+def enviar_em_partes(http_app, caminho, paralelas=4):
+    """Fluxo do painel para arquivos grandes: abre a sessão, manda as partes em paralelo e finaliza.
+    Mede até o 202: a montagem e a gravação ficam com a fila (JOB_WORKERS)."""
+    with ArquivoUnico(caminho) as f:
+        dados = f.read()
+    sessao = http_app.post("/api/uploads", json={"filename": "foto.jpg", "content_type": "image/jpeg", "size": len(dados)})
+    sessao.raise_for_status()
+    sessao = sessao.json()
+    tamanho = sessao["part_size"]
+
+    def parte(n):
+        return http_app.put(f"/api/uploads/{sessao['id']}/parts/{n}", content=dados[n * tamanho:(n + 1) * tamanho]).status_code == 200
+
+    with ThreadPoolExecutor(max_workers=paralelas) as pool:
+        if not all(pool.map(parte, range(sessao["parts"]))):
+            return False
+    return http_app.post("/api/upload", data={"upload_id": sessao["id"], "tags": "bench"}).status_code == 202
+
+def cenario_upload(http_app, http_fake, pasta, tamanhos, repeticoes, concorrencia):
+    resultados = []
+    controle(http_fake, "reset")
+    for mb in tamanhos:
+        caminho = arquivo_imagem(pasta, mb)
+        for c in (1, concorrencia):
+            resultados.append(medir(
+                f"upload {mb} MB",
+                lambda i: enviar(http_app, caminho).status_code < 300,
+                repeticoes * c,
+                concorrencia=c,
+            ))
+            resultados.append(medir(
+                f"upload em partes {mb} MB",
+                lambda i: enviar_em_partes(http_app, caminho),
+                repeticoes * c,
+                concorrencia=c,
+            ))
+    return resultados
+
+def cenario_update_delete(http_app, http_fake, pasta, repeticoes):
+    controle(http_fake, "reset")
+    controle(http_fake, "seed", table="galeria_tags_jundiai", rows=repeticoes * 2)
+    caminho = arquivo_imagem(pasta, 1)
+    return [
+        medir(
+            "update só tags",
+            lambda i: http_app.post("/api/images/update", data={"old_name": f"seed_{i:08d}.jpg", "tags": "Nova"}).status_code < 300,
+            repeticoes,
+        ),
+        medir(
+            "update com troca de imagem 1 MB",
+            lambda i: enviar(http_app, caminho, "/api/images/update", old_name=f"seed_{i + repeticoes:08d}.jpg").status_code < 300,
+            repeticoes,
+        ),
+        medir(
+            "delete",
+            lambda i: http_app.delete(f"/api/images/seed_{i:08d}.jpg").status_code < 300,
+            repeticoes,
+        ),
+    ]
+
+def imprimir(resultados):
+    colunas = ["cenario", "n", "concorrencia", "p50_ms", "p95_ms", "p99_ms", "erros_pct", "req_s", "pico_rss_mb", "erros"]
+    larguras = {c: max(len(c), *(len(str(r[c])) for r in resultados)) for c in colunas}
+    print("  ".join(c.ljust(larguras[c]) for c in colunas))
+    for r in resultados:
+        print("  ".join(str(r[c]).ljust(larguras[c]) for c in colunas))
+
+def verificar_erros(resultados):
+    """Falha se algum cenário teve erros: respostas rápidas com erro parecem ganho de desempenho"""
+    com_erro = [r for r in resultados if r["erros"]]
+    for r in com_erro:
+        print(f"ERROS: {r['cenario']} (c={r['concorrencia']}): {r['erros']}/{r['n']} ({r['erros_pct']}%)")
+    return not com_erro
+
+def comparar_baseline(resultados, caminho, tolerancia):
+    """Falha se o p95 de algum cenário piorou mais que a tolerância em relação ao baseline"""
+    with open(caminho) as f:
+        anteriores = {(r["cenario"], r["concorrencia"]): r for r in json.load(f)}
+    regressoes = []
+    for r in resultados:
+        antes = anteriores.get((r["cenario"], r["concorrencia"]))
+        if antes and antes["p95_ms"] and r["p95_ms"] > antes["p95_ms"] * (1 + tolerancia):
+            regressoes.append(f"{r['cenario']} (c={r['concorrencia']}): p95 {antes['p95_ms']} -> {r['p95_ms']} ms")
+    for linha in regressoes:
+        print(f"REGRESSÃO: {linha}")
+    return not regressoes
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das rotas do app.py")
+    parser.add_argument("--only", choices=["list", "upload", "update"], action="append")
+    parser.add_argument("--rows", default="100,10000,100000", help="linhas semeadas por cenário de listagem")
+    parser.add_argument("--sizes", default="1,5,20", help="tamanhos de upload em MB")
+    parser.add_argument("--requests", type=int, default=50, help="requisições por cenário")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="latência simulada do Supabase")
+    parser.add_argument("--workers", type=int, default=2, help="workers do gunicorn (WEB_CONCURRENCY)")
+    parser.add_argument("--json", help="grava os resultados neste arquivo")
+    parser.add_argument("--baseline", help="resultados anteriores para detectar regressões")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    cenarios = args.only or ["list", "upload", "update"]
+
+    global PID_APP
+    pasta = tempfile.mkdtemp(prefix="bench_")
+    fake, url_fake = subir_fake(args.latency_ms)
+    servidor = None
+    try:
+        configurar_ambiente(url_fake, pasta)
+        servidor, url_app = subir_app(pasta, args.workers)
+        PID_APP = servidor.pid
+        limites = httpx.Limits(max_connections=args.concurrency * 2)
+        with httpx.Client(base_url=url_app, headers={"x-app-password": SENHA}, timeout=300, limits=limites) as http_app, \
+                httpx.Client(base_url=url_fake, timeout=300) as http_fake:
+            resultados = []
+            if "list" in cenarios:
+                linhas = [int(n) for n in args.rows.split(",")]
+                resultados += cenario_listagem(http_app, http_fake, linhas, args.requests)
+            if "upload" in cenarios:
+                tamanhos = [int(n) for n in args.sizes.split(",")]
+                resultados += cenario_upload(http_app, http_fake, pasta, tamanhos, max(1, args.requests // 10), args.concurrency)
+            if "update" in cenarios:
+                resultados += cenario_update_delete(http_app, http_fake, pasta, args.requests)
+    finally:
+        if servidor:
+            servidor.terminate()
+            servidor.wait()
+        fake.terminate()
+
+    imprimir(resultados)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(resultados, f, indent=2)
+    sem_erros = verificar_erros(resultados)
+    sem_regressao = not args.baseline or comparar_baseline(resultados, args.baseline, args.tolerance)
+    if not (sem_erros and sem_regressao):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Tempo de subida do app.py (import + create_app) em processos novos, como num dyno recém-criado.
+
+Mede a mediana de várias subidas e compara com o orçamento (STARTUP_BUDGET_MS).
+No modo profiler roda uma subida extra com -X importtime e lista os pacotes que
+mais pesam, além de avisar se algum dos que deveriam ser adiados foi carregado.
+
+Uso:
+    python -m bench.startup                      # 5 subidas, orçamento de 500 ms
+    python -m bench.startup --profile --top 20
+    python -m bench.startup --budget-ms 300 --json subida.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CODIGO = "import time; t = time.perf_counter(); import app; app.create_app(); print(time.perf_counter() - t)"
+
+# Carregados só no primeiro uso (ClienteSupabase, formatos_suportados); não devem aparecer na subida
+ADIADOS = ("supabase", "postgrest", "storage3", "gotrue", "realtime", "PIL", "pydantic")
+
+def ambiente():
+    """Variáveis mínimas para o create_app não reclamar; nada é contatado na subida"""
+    env = dict(os.environ)
+    for nome, valor in (("SUPABASE_URL", "http://127.0.0.1:9"), ("SUPABASE_KEY", "startup"),
+                        ("BUCKET_NAME", "startup"), ("APP_PASSWORD", "startup")):
+        env.setdefault(nome, valor)
+    return env
+
+def subir(importtime=False):
+    """Uma subida num processo novo: (segundos do import + create_app, segundos do processo, stderr)"""
+    comando = [sys.executable, *(["-X", "importtime"] if importtime else []), "-c", CODIGO]
+    inicio = time.perf_counter()
+    r = subprocess.run(comando, cwd=RAIZ, env=ambiente(), capture_output=True, text=True, check=True)
+    return float(r.stdout.strip().splitlines()[-1]), time.perf_counter() - inicio, r.stderr
+
+def perfil(stderr):
+    """Soma o tempo próprio (-X importtime) por pacote de topo e devolve ([(pacote, ms)], módulos)"""
+    por_pacote, modulos = {}, set()
+    for linha in stderr.splitlines():
+        if not linha.startswith("import time:") or "self [us]" in linha:
+            continue
+        proprio, _, modulo = linha[len("import time:"):].split("|")
+        modulo = modulo.strip()
+        modulos.add(modulo)
+        pacote = modulo.split(".")[0]
+        por_pacote[pacote] = por_pacote.get(pacote, 0) + int(proprio) / 1000
+    return sorted(por_pacote.items(), key=lambda p: -p[1]), modulos
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo de subida do app.py")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "500")))
+    parser.add_argument("--profile", action="store_true", help="lista os pacotes mais pesados (-X importtime)")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="grava o resultado neste arquivo")
+    args = parser.parse_args()
+
+    subidas = [subir() for _ in range(args.runs)]
+    resultado = {
+        "app_ms": round(statistics.median(s[0] for s in subidas) * 1000, 1),
+        "processo_ms": round(statistics.median(s[1] for s in subidas) * 1000, 1),
+        "orcamento_ms": args.budget_ms,
+    }
+    _, _, stderr = subir(importtime=True)
+    pacotes, modulos = perfil(stderr)
+    resultado["adiados_carregados"] = sorted({m.split(".")[0] for m in modulos} & set(ADIADOS))
+    resultado["pacotes"] = [{"pacote": p, "ms": round(ms, 1)} for p, ms in pacotes[:args.top]]
+
+    situacao = "OK" if resultado["app_ms"] <= args.budget_ms else "ACIMA DO ORÇAMENTO"
+    print(f"subida (mediana de {args.runs}): import + create_app {resultado['app_ms']} ms | "
+          f"processo {resultado['processo_ms']} ms | orçamento {args.budget_ms:.0f} ms  {situacao}")
+    if args.profile:
+        print("\npacotes mais pesados no import (tempo próprio, -X importtime):")
+        for item in resultado["pacotes"]:
+            print(f"  {item['ms']:8.1f} ms  {item['pacote']}")
+    if resultado["adiados_carregados"]:
+        print(f"\nATENÇÃO: carregados na subida, mas deveriam ficar para o primeiro uso: {', '.join(resultado['adiados_carregados'])}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(resultado, f, indent=2)
+    if situacao != "OK":
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Gera os assets estáticos do painel em static/dist.
+
+- CSS do Tailwind compilado com apenas as classes usadas em static/src/admin.html
+- Ícones do lucide servidos localmente
+- Nomes com hash de conteúdo (podem ficar em cache para sempre)
+- Versões .gz (e .br, se o módulo brotli estiver instalado) pré-comprimidas
+
+Uso: npm install && python build_assets.py
+"""
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(RAIZ, "static", "src")
+DIST = os.path.join(RAIZ, "static", "dist")
+LUCIDE = os.path.join(RAIZ, "node_modules", "lucide", "dist", "umd", "lucide.min.js")
+BLOCO_ASSETS = re.compile(r"<!-- assets:inicio -->.*?<!-- assets:fim -->", re.S)
+
+def renomear_com_hash(caminho):
+    """Renomeia admin.css -> admin.<hash>.css e devolve o novo nome"""
+    with open(caminho, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    base, ext = os.path.splitext(os.path.basename(caminho))
+    nome = f"{base}.{digest}{ext}"
+    os.replace(caminho, os.path.join(DIST, nome))
+    return nome
+
+def comprimir(caminho):
+    """Grava as versões .gz e .br ao lado do arquivo"""
+    with open(caminho, "rb") as f:
+        conteudo = f.read()
+    with open(caminho + ".gz", "wb") as f:
+        f.write(gzip.compress(conteudo, compresslevel=9, mtime=0))
+    if brotli:
+        with open(caminho + ".br", "wb") as f:
+            f.write(brotli.compress(conteudo, quality=11))
+
+def main():
+    shutil.rmtree(DIST, ignore_errors=True)
+    os.makedirs(DIST)
+
+    # 1. Tailwind: só as classes encontradas no HTML/JS do painel
+    subprocess.run([
+        "npx", "tailwindcss",
+        "-c", os.path.join(RAIZ, "tailwind.config.js"),
+        "-i", os.path.join(SRC, "admin.css"),
+        "-o", os.path.join(DIST, "admin.css"),
+        "--minify",
+    ], cwd=RAIZ, check=True)
+    css = renomear_com_hash(os.path.join(DIST, "admin.css"))
+
+    # 2. Ícones locais
+    shutil.copyfile(LUCIDE, os.path.join(DIST, "lucide.js"))
+    icones = renomear_com_hash(os.path.join(DIST, "lucide.js"))
+
+    # 3. HTML apontando para os arquivos com hash
+    with open(os.path.join(SRC, "admin.html"), encoding="utf-8") as f:
+        html = f.read()
+    html = BLOCO_ASSETS.sub(
+        f'<link rel="stylesheet" href="/assets/{css}">\n'
+        f'    <script defer src="/assets/{icones}"></script>',
+        html,
+    )
+    with open(os.path.join(DIST, "index.html"), "w", encoding="utf-8") as f:
+        f.write(html)
+
+    for nome in (css, icones, "index.html"):
+        comprimir(os.path.join(DIST, nome))
+    print(f"Assets gerados em {DIST}: {css}, {icones}" + ("" if brotli else " (sem .br: instale brotli)"))
+
+if __name__ == "__main__":
+    main()
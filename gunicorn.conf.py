@@ -0,0 +1,13 @@
+import os
+
+# Configuração do gunicorn
+# Por padrão usa workers gevent: cada processo atende centenas de requisições
+# presas em I/O (Supabase/Storage) em vez de uma por vez.
+# WORKER_CLASS=sync volta ao modo antigo.
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = os.getenv("WORKER_CLASS", "gevent")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_connections = int(os.getenv("WORKER_CONNECTIONS", "500"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+graceful_timeout = 30
@@ -0,0 +1,4 @@
+-- Variantes geradas no upload (thumb/medium/full em AVIF, WebP e JPEG)
+-- Formato: {"thumb": {"largura": 320, "webp": "<url>", "jpeg": "<url>"}, ...}
+alter table galeria_tags_jundiai add column if not exists variantes jsonb;
+alter table promocoes_ativas_jundiai add column if not exists variantes jsonb;
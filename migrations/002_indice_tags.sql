@@ -0,0 +1,43 @@
+-- Índice de tags da galeria
+-- tags_norm: tags sem acento, minúsculas e sem duplicatas (gravado pelo app, ver campos_tags)
+-- tags_busca: as mesmas tags num texto só, para a busca parcial ?q=
+create extension if not exists unaccent;
+create extension if not exists pg_trgm;
+
+alter table galeria_tags_jundiai add column if not exists tags_norm text[] not null default '{}';
+alter table galeria_tags_jundiai add column if not exists tags_busca text not null default '';
+
+-- Preenche as linhas antigas com a mesma normalização do app
+update galeria_tags_jundiai g set
+    tags_norm = n.tags_norm,
+    tags_busca = array_to_string(n.tags_norm, ' ')
+from (
+    select nome_arquivo, coalesce(array_agg(distinct t order by t) filter (where t <> ''), '{}') as tags_norm
+    from (
+        select nome_arquivo,
+               trim(regexp_replace(regexp_replace(lower(unaccent(x)), '[^a-z0-9 _-]', '', 'g'), '\s+', ' ', 'g')) as t
+        from galeria_tags_jundiai, unnest(string_to_array(coalesce(tags, ''), ',')) as x
+    ) s
+    group by nome_arquivo
+) n
+where g.nome_arquivo = n.nome_arquivo;
+
+create index if not exists galeria_tags_norm_gin on galeria_tags_jundiai using gin (tags_norm);
+create index if not exists galeria_tags_busca_trgm on galeria_tags_jundiai using gin (tags_busca gin_trgm_ops);
+
+-- Facetas: contagem por tag dentro do mesmo filtro de /api/images
+create or replace function contagem_tags_galeria(
+    p_tags text[] default null,
+    p_todas boolean default true,
+    p_q text default null
+)
+returns table (tag text, total bigint)
+language sql stable
+as $$
+    select t.tag, count(*) as total
+    from galeria_tags_jundiai g, unnest(g.tags_norm) as t(tag)
+    where (p_tags is null or case when p_todas then g.tags_norm @> p_tags else g.tags_norm && p_tags end)
+      and (p_q is null or g.tags_busca ilike '%' || p_q || '%')
+    group by t.tag
+    order by total desc, t.tag
+$$;
@@ -0,0 +1,15 @@
+-- Arquivos endereçados por conteúdo (nome = sha256 + extensão)
+-- Uma mesma imagem pode ser usada por uma linha da galeria e uma das promoções;
+-- o blob só sai do storage quando nenhuma das duas tabelas o referencia.
+create unique index if not exists galeria_nome_arquivo_unico on galeria_tags_jundiai (nome_arquivo);
+create unique index if not exists promocoes_nome_arquivo_unico on promocoes_ativas_jundiai (nome_arquivo);
+
+create or replace function blob_referencias(p_nome text)
+returns integer
+language sql stable
+as $$
+    select (
+        (select count(*) from galeria_tags_jundiai where nome_arquivo = p_nome) +
+        (select count(*) from promocoes_ativas_jundiai where nome_arquivo = p_nome)
+    )::integer
+$$;
@@ -0,0 +1,60 @@
+-- Feed de alterações (/api/changes)
+-- updated_at: carimbo da última escrita em cada linha, mantido por trigger
+-- registro_remocoes: lápides das linhas apagadas (ou renomeadas na troca de imagem)
+alter table galeria_tags_jundiai add column if not exists updated_at timestamptz not null default now();
+alter table promocoes_ativas_jundiai add column if not exists updated_at timestamptz not null default now();
+
+-- Linhas antigas entram no feed na ordem em que foram criadas
+update galeria_tags_jundiai set updated_at = created_at where created_at is not null;
+update promocoes_ativas_jundiai set updated_at = created_at where created_at is not null;
+
+create index if not exists galeria_updated_at on galeria_tags_jundiai (updated_at, nome_arquivo);
+create index if not exists promocoes_updated_at on promocoes_ativas_jundiai (updated_at, nome_arquivo);
+
+create table if not exists registro_remocoes (
+    id bigserial primary key,
+    tabela text not null,
+    nome_arquivo text not null,
+    removido_em timestamptz not null default clock_timestamp()
+);
+
+-- clock_timestamp e não now(): várias escritas na mesma transação ficam ordenadas
+create or replace function marcar_updated_at()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.updated_at := clock_timestamp();
+    return new;
+end
+$$;
+
+create or replace function registrar_remocao()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_op = 'DELETE' or old.nome_arquivo is distinct from new.nome_arquivo then
+        insert into registro_remocoes (tabela, nome_arquivo) values (tg_table_name, old.nome_arquivo);
+    end if;
+    return null;
+end
+$$;
+
+drop trigger if exists galeria_updated_at on galeria_tags_jundiai;
+create trigger galeria_updated_at before insert or update on galeria_tags_jundiai
+    for each row execute function marcar_updated_at();
+drop trigger if exists promocoes_updated_at on promocoes_ativas_jundiai;
+create trigger promocoes_updated_at before insert or update on promocoes_ativas_jundiai
+    for each row execute function marcar_updated_at();
+
+drop trigger if exists galeria_remocao on galeria_tags_jundiai;
+create trigger galeria_remocao after delete or update of nome_arquivo on galeria_tags_jundiai
+    for each row execute function registrar_remocao();
+drop trigger if exists promocoes_remocao on promocoes_ativas_jundiai;
+create trigger promocoes_remocao after delete or update of nome_arquivo on promocoes_ativas_jundiai
+    for each row execute function registrar_remocao();
+
+-- Lápides mais antigas que a retenção podem ser apagadas por um job periódico;
+-- consumidores com token mais velho que isso precisam refazer a carga completa.
+create index if not exists registro_remocoes_removido_em on registro_remocoes (removido_em);
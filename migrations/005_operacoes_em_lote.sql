@@ -0,0 +1,70 @@
+-- Operações em lote (/api/images/bulk-*, /api/promotions/bulk-delete)
+
+-- Mesma normalização do app (normalizar_tag) e da migração 002
+create or replace function normalizar_tag(p_tag text)
+returns text
+language sql stable
+as $$
+    select trim(regexp_replace(regexp_replace(lower(unaccent(coalesce(p_tag, ''))), '[^a-z0-9 _-]', '', 'g'), '\s+', ' ', 'g'))
+$$;
+
+-- Acrescenta e/ou remove tags de várias fotos num único update.
+-- Seleção: p_nomes (lista de arquivos) e/ou o mesmo filtro da listagem (p_tags + p_todas, p_q).
+-- Sem nenhum critério não altera nada. Devolve só as linhas que mudaram.
+create or replace function retag_galeria(
+    p_nomes text[] default null,
+    p_tags text[] default null,
+    p_todas boolean default true,
+    p_q text default null,
+    p_adicionar text[] default '{}',
+    p_remover text[] default '{}'
+)
+returns setof galeria_tags_jundiai
+language sql volatile
+as $$
+    with alvo as (
+        select nome_arquivo, tags from galeria_tags_jundiai
+        where (p_nomes is not null or p_tags is not null or p_q is not null)
+          and (p_nomes is null or nome_arquivo = any(p_nomes))
+          and (p_tags is null or (case when p_todas then tags_norm @> p_tags else tags_norm && p_tags end))
+          and (p_q is null or tags_busca ilike '%' || p_q || '%')
+    ),
+    itens as (
+        select a.nome_arquivo, trim(x) as texto, ord
+        from alvo a, unnest(string_to_array(coalesce(a.tags, ''), ',')) with ordinality as u(x, ord)
+        union all
+        select a.nome_arquivo, trim(x), 1000000 + ord
+        from alvo a, unnest(coalesce(p_adicionar, '{}')) with ordinality as u(x, ord)
+    ),
+    -- Uma ocorrência por tag normalizada, mantendo a grafia e a posição da primeira
+    mantidas as (
+        select distinct on (nome_arquivo, norm) nome_arquivo, texto, ord, norm
+        from (select *, normalizar_tag(texto) as norm from itens) i
+        where norm <> '' and not (norm = any(coalesce(p_remover, '{}')))
+        order by nome_arquivo, norm, ord
+    ),
+    novas as (
+        select a.nome_arquivo,
+               coalesce(string_agg(m.texto, ', ' order by m.ord), '') as tags,
+               coalesce(array_agg(m.norm order by m.norm) filter (where m.norm is not null), '{}') as tags_norm
+        from alvo a left join mantidas m using (nome_arquivo)
+        group by a.nome_arquivo
+    )
+    update galeria_tags_jundiai g set
+        tags = n.tags,
+        tags_norm = n.tags_norm,
+        tags_busca = array_to_string(n.tags_norm, ' ')
+    from novas n
+    where g.nome_arquivo = n.nome_arquivo and g.tags is distinct from n.tags
+    returning g.*
+$$;
+
+-- Dos blobs informados, os que nenhuma linha das duas tabelas referencia mais
+create or replace function blobs_sem_referencia(p_nomes text[])
+returns table (nome_arquivo text)
+language sql stable
+as $$
+    select n from unnest(p_nomes) as n
+    where not exists (select 1 from galeria_tags_jundiai g where g.nome_arquivo = n)
+      and not exists (select 1 from promocoes_ativas_jundiai p where p.nome_arquivo = n)
+$$;
@@ -0,0 +1,4 @@
+-- Feed de alterações: lápides lidas por (removido_em, id), como as tabelas por (updated_at, nome_arquivo),
+-- e apagadas pela tarefa podar_remocoes depois de CHANGES_RETENTION_DAYS
+create index if not exists registro_remocoes_removido_em_id on registro_remocoes (removido_em, id);
+drop index if exists registro_remocoes_removido_em;
@@ -0,0 +1,6 @@
+/** Classes usadas no painel (HTML + templates JS inline em static/src/admin.html) */
+module.exports = {
+  content: ["./static/src/**/*.html"],
+  theme: { extend: {} },
+  plugins: [],
+};